@@ -1,11 +1,12 @@
 # First Party
+import json
 import os
 import zipfile
 import time
 
 # Third Party
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask import jsonify, send_from_directory, after_this_request
+from flask import jsonify, send_from_directory, after_this_request, Response
 import redis
 from rq import Queue
 from rq.job import Job
@@ -13,7 +14,8 @@ from rq.exceptions import NoSuchJobError
 
 # local
 from .tea.params import PATH
-from .tasks import text_extraction, delete_files, delete_folder
+from .tasks import submit_extraction, graph_status, cancel_graph, save_files, delete_files, delete_folder
+from .tasks import progress_channel, shard_progress
 
 
 # *********************
@@ -22,6 +24,9 @@ from .tasks import text_extraction, delete_files, delete_folder
 main = Blueprint('main', __name__)
 r = redis.Redis()
 q = Queue(connection=r, default_timeout=3600)
+SSE_IDLE_SECONDS = 15   # Without events the job is re-read, which also detects closed connections
+SSE_RETRY_MS = 3000     # Client reconnect delay after a dropped stream
+FINAL_STATUSES = ('finished', 'failed', 'unknown')
 
 # *********************
 # GENERIC ROUTES
@@ -35,6 +40,9 @@ def tea():
     # Retrieve user inputs
     texts   = request.files.getlist('texts[]')
     labels  = request.files.getlist('labels[]')
+    # A single zip or tar.gz can be uploaded in place of either folder
+    texts   += [f for f in request.files.getlist('texts_archive') if f.filename]
+    labels  += [f for f in request.files.getlist('labels_archive') if f.filename]
     word    = request.form.get('label_word')
     exts    = request.form.get('extensions')
     exts    = exts.split(' ') if exts else []
@@ -55,7 +63,8 @@ def tea():
     save_files(labels, labels_path, exts)
     save_files(texts, texts_path, exts)
 
-    job = q.enqueue(text_extraction, unique_id, texts_path, labels_path, result_path, metric_path, word, exts)
+    # Large uploads are sharded across workers, the returned job stands for the whole upload
+    job = submit_extraction(q, unique_id, texts_path, labels_path, result_path, metric_path, word, exts)
     return redirect(url_for('main.progress', job_id=job.get_id()))
     # return redirect(url_for('main.download', filename=zipfile, unique_id=unique_id))
 
@@ -73,19 +82,13 @@ def job_status(job_id):
     print("Activated jobstatus", job_id)
     try: job = Job.fetch(job_id, connection=r)
     except NoSuchJobError: return jsonify({'status': 'unknown'})
-     
-    if job.is_finished:
-        # Assuming job.result contains the URL to the PDF
-        return jsonify({'status': 'finished', 'result': job.result})
-    elif job.is_queued:
-        return jsonify({'status': 'queued'})
-    elif job.is_started:
-        progress = job.meta.get('progress', 0)
-        return jsonify({'status': 'started', 'progress': progress})
-    elif job.is_failed:
-        return jsonify({'status': 'failed'})
-    else:
-        return jsonify({'status': 'unknown'})
+    return jsonify(job_state(job))
+
+@main.route('/job-events/<job_id>')
+def job_events(job_id):
+    # Server-sent events, status is pushed as the job publishes progress instead of polled
+    return Response(stream_events(job_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @main.route("/download/<filename>")
 def download(filename):
@@ -106,7 +109,7 @@ def download(filename):
 @main.route('/cancel-job/<job_id>', methods=['POST'])
 def cancel_job(job_id):
     job = Job.fetch(job_id, connection=r)
-    job.cancel()
+    cancel_graph(job)
     return jsonify({'status': 'canceled'})
 
 
@@ -139,6 +142,53 @@ def get_unique_user_path(base_path, unique_id: str):
     os.makedirs(user_path, exist_ok=True)
     return user_path
 
+def job_state(job) -> dict:
+    # Sharded uploads report their shards' progress until the reduce job starts
+    status = graph_status(job)
+    if status: return status
+    if job.is_finished:
+        # Assuming job.result contains the URL to the PDF
+        return {'status': 'finished', 'result': job.result}
+    elif job.is_queued:
+        return {'status': 'queued'}
+    elif job.is_started:
+        progress = job.meta.get('progress', 0)
+        return {'status': 'started', 'progress': progress}
+    elif job.is_failed:
+        return {'status': 'failed'}
+    else:
+        return {'status': 'unknown'}
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+def stream_events(job_id):
+    # Subscribes before the first state is read, so no event is lost between the two
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    try:
+        job = Job.fetch(job_id, connection=r)
+        unique_id = job.meta.get('unique_id')
+        if unique_id: pubsub.subscribe(progress_channel(unique_id))
+        shards = shard_progress(Job.fetch_many(job.meta['shards'], connection=r)) if job.meta.get('shards') else []
+        status = job_state(job)
+        yield f"retry: {SSE_RETRY_MS}\n" + sse_event(status)
+        # Jobs queued without a channel get their state per reconnect instead
+        if not unique_id: return
+
+        while status['status'] not in FINAL_STATUSES:
+            message = pubsub.get_message(timeout=SSE_IDLE_SECONDS)
+            if message is None:
+                job.refresh()
+                status = job_state(job)
+            else:
+                status = json.loads(message['data'])
+                if 'shard' in status:
+                    shards[status['shard']] = status['progress']
+                    status = {'status': 'started', 'progress': sum(shards) / len(shards)}
+            yield sse_event(status)
+    except NoSuchJobError: yield sse_event({'status': 'unknown'})
+    finally: pubsub.close()
+
 # def zip_file(path, unique_id):
 #     zip_filename = f"{unique_id}-results.zip"
 #     zip_path = os.path.join(path, zip_filename)
@@ -151,14 +201,6 @@ def get_unique_user_path(base_path, unique_id: str):
 #     # url_for('main.download', filename=f'{id}-results.zip', unique_id=id)
 #     return zip_filename
 
-def save_files(files, path, exts):
-    if files is None: return -1
-    for file in files:
-        if os.path.splitext(file.filename)[1] not in exts: continue
-        full_path = os.path.join(path, file.filename)
-        open(full_path, 'w').write(file.read().decode('utf-8'))
-    return 0
-
 # def delete_files(files, path):
 #     for file in files:
 #         file_name = file if isinstance(file, str) else file.filename
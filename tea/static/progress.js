@@ -1,33 +1,64 @@
 $(document).ready(function() {
+    // Progress is pushed over server-sent events, polling is the fallback for browsers or proxies without them
+    const MAX_STREAM_ERRORS = 5;
     let progressInterval;
+    let source;
+    let streamErrors = 0;
+
+    function stopUpdates() {
+        clearInterval(progressInterval);
+        if (source) source.close();
+    }
+
+    function render(data) {
+        if (data.status === 'finished') {
+            $('#progress-bar').css('width', '100%').attr('aria-valuenow', 100).text('100%');
+            $('#result-message').text('Processing complete, zip available for download').show();
+            $('#download-button').removeClass('disabled'); 
+            $('#download-button').attr('href', '/tea/download/' + encodeURIComponent(data.result)).show();
+            $('#home-button').attr('href', '/tea/').show();
+            $('#cancel-button').attr('disabled', true);
+ 
+            stopUpdates();
+        } else if (data.status === 'started') {
+            $('#download-button').addClass('disabled');
+            $('#progress-bar').css('width', data.progress + '%').attr('aria-valuenow', data.progress).text(Math.round(data.progress) + '%');
+        } else if (data.status === 'queued' || data.status === 'failed') {
+            $('#progress-bar').css('width', '0%').attr('aria-valuenow', 0).text('0%');
+            if (data.status === 'failed') {
+                $('#error-message').text('Task failed. Please try again.').show();
+                stopUpdates();
+            }
+        }
+    }
+
     function updateProgress() {
         $.get('/tea/job-status/' + encodeURIComponent(jobId))
-            .done(function(data) {
-                if (data.status === 'finished') {
-                    $('#progress-bar').css('width', '100%').attr('aria-valuenow', 100).text('100%');
-                    $('#result-message').text('Processing complete, zip available for download').show();
-                    $('#download-button').removeClass('disabled'); 
-                    $('#download-button').attr('href', '/tea/download/' + encodeURIComponent(data.result)).show();
-                    $('#home-button').attr('href', '/tea/').show();
-                    $('#cancel-button').attr('disabled', true);
-         
-                    clearInterval(progressInterval);
-                } else if (data.status === 'started') {
-                    $('#download-button').addClass('disabled');
-                    $('#progress-bar').css('width', data.progress + '%').attr('aria-valuenow', data.progress).text(Math.round(data.progress) + '%');
-                } else if (data.status === 'queued' || data.status === 'failed') {
-                    $('#progress-bar').css('width', '0%').attr('aria-valuenow', 0).text('0%');
-                    if (data.status === 'failed') {
-                        $('#error-message').text('Task failed. Please try again.').show();
-                    }
-                }
-            })
+            .done(render)
             .fail(function(jqXHR, textStatus, errorThrown) {
                 console.error("Error fetching job status:", textStatus, errorThrown);
             });
     }
 
-    progressInterval = setInterval(updateProgress, 1000);
+    function startPolling() {
+        if (source) source.close();
+        updateProgress();
+        progressInterval = setInterval(updateProgress, 1000);
+    }
+
+    function startStream() {
+        source = new EventSource('/tea/job-events/' + encodeURIComponent(jobId));
+        source.onopen = function() { streamErrors = 0; };
+        source.onmessage = function(event) { render(JSON.parse(event.data)); };
+        source.onerror = function() {
+            // The browser reconnects on its own, repeated failures or a closed stream fall back to polling
+            streamErrors += 1;
+            if (source.readyState === EventSource.CLOSED || streamErrors >= MAX_STREAM_ERRORS) startPolling();
+        };
+    }
+
+    if (window.EventSource) startStream();
+    else startPolling();
 
     $('#cancel-form').on('submit', function(event) {
         event.preventDefault();
@@ -36,7 +67,7 @@ $(document).ready(function() {
                 if (data.status === 'canceled') {
                     $('#progress-bar').css('width', '0%').attr('aria-valuenow', 0).text('Canceled');
                     $('#cancel-button').attr('disabled', true);
-                    clearInterval(progressInterval);
+                    stopUpdates();
                     setTimeout(function() {window.location.href = '/tea/';}, 1000);
                 } else {
                     $('#error-message').text('Unable to cancel task.').show();
@@ -46,4 +77,4 @@ $(document).ready(function() {
                 console.error("Error canceling job:", textStatus, errorThrown);
             });
     });
-});
\ No newline at end of file
+});
@@ -1,16 +1,70 @@
 # First Party Imports
+import codecs
+import io
+import json
 import os
+import shutil
 import time
-import zipfile
+from functools import partial
+from itertools import groupby
 
 # Third Party Imports
 from rq import get_current_job
+from rq.job import Job
 
 # Local Imports
 from .tea.params import PATH
 from .tea.main import extract_text
+from .tea.analysis import analysis_entry
+from .tea.archive import Member, ResultArchive, is_archive, is_member, is_zip, iter_members, list_members
+from .tea.instrument import JobMetaExporter, recording
+from .tea.utils import convert_to_series, metrics
 
-CHUNK_SIZE = 20
+PROGRESS_SECONDS = 1    # Minimum time between job meta updates
+SHARD_SIZE = 500        # Uploads with more documents are split into shard jobs
+# Shards of one upload run on several rq workers of the host at once, so each shard's extraction pool
+# gets an equal share of the cores. TEA_RQ_WORKERS is the number of rq workers started per host
+RQ_WORKERS = int(os.environ.get('TEA_RQ_WORKERS', 4))
+SHARD_WORKERS = max(1, (os.cpu_count() or 1) // RQ_WORKERS)
+GRAPH_RESULT_TTL = 86400    # Analysis and shard results must outlive the slowest shard for the reduce job
+UPLOAD_CHUNK_BYTES = 1 << 20    # Upload parts are copied to disk in chunks of this size
+UPLOAD_ERRORS = "replace"       # Decode policy for non UTF-8 uploads, "strict" skips the file instead
+
+# *********************
+# PROGRESS REPORTING
+# *********************
+class JobProgress:
+    # Publishes progress and instrumentation to the job meta, and a progress event to the upload's
+    # channel, at most every interval, independent of how the extractor batches its work
+    def __init__(self, job, recorder, unique_id, event: dict=None, interval: float=PROGRESS_SECONDS):
+        self.job, self.recorder, self.unique_id, self.interval = job, recorder, unique_id, interval
+        self.event = event or {'status': 'started'}
+        self.last = 0
+
+    def __call__(self, done: int, total: int):
+        now = time.monotonic()
+        if done < total and now - self.last < self.interval: return
+        self.last = now
+        self.job.meta['progress'] = done / total * 100
+        self.recorder.export()
+        publish(self.job, self.unique_id, {**self.event, 'progress': self.job.meta['progress']})
+
+
+def progress_channel(unique_id) -> str:
+    return f"tea:progress:{unique_id}"
+
+
+def publish(job, unique_id, event: dict):
+    # Pub/sub is fire and forget, a client that misses an event reads the job state when it reconnects
+    job.connection.publish(progress_channel(unique_id), json.dumps(event))
+
+
+def run_published(job, unique_id, func, *args):
+    # A failure in any job of the upload ends the upload's event stream
+    try: return func(*args)
+    except Exception:
+        publish(job, unique_id, {'status': 'failed'})
+        raise
 
 # *********************
 # TASK FUNCTIONS
@@ -18,34 +72,52 @@ CHUNK_SIZE = 20
 def text_extraction(unique_id, texts_path, labels_path, result_path, metric_path, word, exts):
 
     job = get_current_job()
+    # Stage and per-document stats are published to the job meta with the progress
+    with recording(JobMetaExporter(job)) as recorder:
+        zipfile = run_published(job, unique_id, run_extraction, job, recorder, unique_id, texts_path, labels_path,
+                                result_path, metric_path, word, exts)
+    publish(job, unique_id, {'status': 'finished', 'result': zipfile})
+    return zipfile
 
-    text_mask = [get_name(f) for f in get_files(texts_path)]
-    labels = get_files(labels_path)
-    
-    results = []
-    total_files = len(text_mask)  # Total number of text files
-    for i in range(0, len(text_mask), CHUNK_SIZE):
-        chunk = text_mask[i:i+CHUNK_SIZE]
-        print(f"Chunk: {i} - {i+CHUNK_SIZE}")
 
-        job.meta['progress'] = (i + len(chunk)) / total_files * 100
-        job.save_meta()
+def run_extraction(job, recorder, unique_id, texts_path, labels_path, result_path, metric_path, word, exts):
+    # The upload is walked once and extracted by a single worker pool for the whole job
+    unpack_labels(labels_path, word)
+    texts = list_texts(get_files(texts_path), word, exts)
+    with ResultArchive(os.path.join(result_path, archive_name(unique_id))) as archive:
+        extract_files(job, recorder, unique_id, texts, texts_path, word, exts, archive)
+    return package_results(job, unique_id, texts_path, labels_path, result_path, metric_path)
 
-        # Extract text
-        extract_text(unique_id, word, chunk, ext=exts, log=False, test=True)
 
-        # Save result files names
-        results.extend([f"{f}_{word}.txt" for f in chunk])
-        delete_files(chunk, texts_path)
-    
-    # Zip and return download link
-    zipfile = zip_file(result_path, unique_id)
+def extract_files(job, recorder, unique_id, texts, texts_path, word, exts, archive, event=None, workers=None):
+    report = JobProgress(job, recorder, unique_id, event)
+
+    def on_document(source, done, total):
+        # Uploads are removed as they are extracted, so disk use shrinks during the job.
+        # Archive members are read in memory, the archive goes with the rest of the upload
+        if not isinstance(source, tuple): delete_files([os.path.relpath(source, texts_path)], texts_path)
+        report(done, total)
+
+    # Extract text into the archive, scores are returned for the reduce step of sharded uploads
+    scores = extract_text(unique_id, word, {text_name(t) for t in texts}, ext=exts, log=False, test=True,
+                          workers=workers, files=open_texts(texts), total=len(texts), progress=on_document,
+                          archive=archive)
+    recorder.export()
+    return scores or []
+
+
+def package_results(job, unique_id, texts_path, labels_path, result_path, metric_path):
+    # Uploads that were not extracted, e.g. other extensions, are removed with the rest
+    delete_files(get_files(texts_path), texts_path)
+
+    # The archive is complete once extraction ends, only its name is returned for the download link
+    zipfile = archive_name(unique_id)
 
     # Delete remaining files
     print("Deleting files...")
-    delete_files(results, result_path)
-    delete_files(labels, labels_path)
-    delete_files(['roi_dataset.csv', 'title_keywords.json'], metric_path)
+    delete_files([f for f in get_files(result_path) if os.path.basename(f) != zipfile], result_path)
+    delete_files(get_files(labels_path), labels_path)
+    delete_files(['roi_dataset.csv', 'title_keywords.json', 'constants.json'], metric_path)
     
     delete_folder(texts_path)
     delete_folder(labels_path)
@@ -57,12 +129,135 @@ def text_extraction(unique_id, texts_path, labels_path, result_path, metric_path
     job.save_meta()
     return zipfile
 
+# *********************
+# MAP REDUCE TASKS
+# *********************
+# Large uploads run as a job graph: one analysis job, shard jobs that depend on it and can run on
+# any worker, and a reduce job that depends on every shard. The upload folders are shared by the workers
+def submit_extraction(queue, unique_id, texts_path, labels_path, result_path, metric_path, word, exts,
+                      shard_size: int=SHARD_SIZE) -> Job:
+    # Returns the job whose status and result the client follows
+    args = (unique_id, texts_path, labels_path, result_path, metric_path)
+    uploads = get_files(texts_path)
+    # Listing a tar.gz reads the whole stream, so those uploads are listed in a single job's worker
+    # The unique id names the upload's progress channel
+    single = partial(queue.enqueue, text_extraction, *args, word, exts, meta={'unique_id': unique_id})
+    if any(is_archive(f) and not is_zip(f) for f in uploads): return single()
+    texts = list_texts(uploads, word, exts)
+    if len(texts) <= shard_size: return single()
+
+    analysis = queue.enqueue(analyze_upload, unique_id, labels_path, metric_path, word, result_ttl=GRAPH_RESULT_TTL)
+    shards = [queue.enqueue(extract_shard, unique_id, part, texts[i:i+shard_size], texts_path, result_path, word, exts,
+                            depends_on=analysis, result_ttl=GRAPH_RESULT_TTL)
+              for part, i in enumerate(range(0, len(texts), shard_size))]
+    return queue.enqueue(reduce_shards, *args, depends_on=shards,
+                         meta={'analysis': analysis.id, 'shards': [shard.id for shard in shards], 'progress': 0,
+                               'unique_id': unique_id})
+
+
+def analyze_upload(unique_id, labels_path, metric_path, word):
+    # Shards load the stored constants and keyword scores, so analysis runs once per upload
+    def analyze():
+        unpack_labels(labels_path, word)
+        analysis_entry(labels_path, metric_path, word)
+    run_published(get_current_job(), unique_id, analyze)
+
+
+def extract_shard(unique_id, part, texts, texts_path, result_path, word, exts):
+    job = get_current_job()
+    # Each shard writes its own part archive, the reduce job merges them
+    def extract(recorder):
+        with ResultArchive(os.path.join(result_path, archive_name(unique_id, part))) as archive:
+            return extract_files(job, recorder, unique_id, texts, texts_path, word, exts, archive, {'shard': part},
+                                 SHARD_WORKERS)
+    with recording(JobMetaExporter(job)) as recorder: scores = run_published(job, unique_id, extract, recorder)
+    job.meta['progress'] = 100
+    job.save_meta()
+    return scores
+
+
+def reduce_shards(unique_id, texts_path, labels_path, result_path, metric_path):
+    job = get_current_job()
+    zipfile = run_published(job, unique_id, merge_shards, job, unique_id, texts_path, labels_path, result_path,
+                            metric_path)
+    publish(job, unique_id, {'status': 'finished', 'result': zipfile})
+    return zipfile
+
+
+def merge_shards(job, unique_id, texts_path, labels_path, result_path, metric_path):
+    shards = Job.fetch_many(job.meta['shards'], connection=job.connection)
+    # Summary statistics over the whole upload, as a single job would print them
+    scores = [score for shard in shards if shard for score in shard.result or []]
+    print("Files: ", len(scores))
+    metrics(convert_to_series(scores))
+
+    # Parts are merged in shard order and removed once copied
+    with ResultArchive(os.path.join(result_path, archive_name(unique_id))) as archive:
+        for part in range(len(shards)):
+            part_path = os.path.join(result_path, archive_name(unique_id, part))
+            archive.merge(part_path)
+            os.remove(part_path)
+    return package_results(job, unique_id, texts_path, labels_path, result_path, metric_path)
+
+
+def graph_status(job) -> dict:
+    # Status of a sharded upload, progress is the mean over its shards until the reduce job starts
+    if not job.meta.get('shards'): return None
+    jobs = Job.fetch_many([job.meta['analysis'], *job.meta['shards']], connection=job.connection)
+    if any(j is None or j.is_failed or j.is_canceled for j in jobs): return {'status': 'failed'}
+    if not (job.is_deferred or job.is_queued): return None
+    progress = shard_progress(jobs[1:])
+    return {'status': 'started', 'progress': sum(progress) / len(progress)}
+
+
+def shard_progress(shards) -> list:
+    return [0 if s is None else 100 if s.is_finished else s.meta.get('progress', 0) for s in shards]
+
+
+def cancel_graph(job):
+    # Shards and the analysis job are canceled with the reduce job that represents the upload
+    ids = [job.meta['analysis'], *job.meta['shards']] if job.meta.get('shards') else []
+    for j in Job.fetch_many(ids, connection=job.connection):
+        if j and not (j.is_finished or j.is_failed or j.is_canceled): j.cancel()
+    job.cancel()
+
 # *********************
 # HELPER FUNCTIONS
 # *********************
 def get_name(path):
     return os.path.splitext(os.path.basename(path))[0]
 
+def text_name(text):
+    return get_name(text[1] if isinstance(text, tuple) else text)
+
+def list_texts(files, word, exts):
+    # Uploaded files to extract, members of uploaded archives are listed as (archive, member) pairs.
+    # Same filter as the extractor's, files named with the label word are never extracted
+    select = partial(is_member, exts=exts, exclude=word)
+    texts = []
+    for file in files:
+        if is_archive(file): texts.extend(Member(file, member) for member in list_members(file, select))
+        elif select(file): texts.append(file)
+    return texts
+
+def open_texts(texts):
+    # Files and zip members are passed on by name and opened by the workers. A tar.gz can only
+    # be read in order, so its members are read one at a time as the pool takes them
+    for archive, group in groupby(texts, key=lambda text: text.archive if isinstance(text, Member) else None):
+        if archive is None or is_zip(archive): yield from group
+        else:
+            members = {member for _, member in group}
+            yield from iter_members(archive, members.__contains__)
+
+def unpack_labels(labels_path, word):
+    # Labels are small and looked up by name when scoring, so uploaded label archives are written out flat
+    select = partial(is_member, exts=['.txt'], include=word)
+    for file in get_files(labels_path):
+        if not is_archive(file): continue
+        for member, data in iter_members(file, select):
+            save_file(io.BytesIO(data), os.path.join(labels_path, os.path.basename(member)))
+        os.remove(file)
+
 def get_files(path):
     files = []
     for root, _, filenames in os.walk(path):
@@ -76,26 +271,39 @@ def get_unique_user_path(base_path, unique_id: str):
     os.makedirs(user_path, exist_ok=True)
     return user_path
 
-def zip_file(path, unique_id):
-    zip_filename = f"{unique_id}-results.zip"
-    zip_path = os.path.join(path, zip_filename)
-    zipf = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
-    for root, _, files in os.walk(path):
-        for file in files:
-            if file == zip_filename: continue
-            zipf.write(os.path.join(root, file), file)
-    zipf.close()
-    # url_for('main.download', filename=f'{id}-results.zip', unique_id=id)
-    return zip_filename
-
-def save_files(files, path, exts):
+def archive_name(unique_id, part=None):
+    # Shards write numbered part archives that the reduce job merges into the results archive
+    return f"{unique_id}-results.zip" if part is None else f"{unique_id}-part-{part}.zip"
+
+def save_files(files, path, exts, errors=UPLOAD_ERRORS):
     if files is None: return -1
     for file in files:
+        # Archives are kept as uploaded, their members are read by the worker
+        if is_archive(file.filename):
+            save_archive(file.stream, os.path.join(path, os.path.basename(file.filename)))
+            continue
         if os.path.splitext(file.filename)[1] not in exts: continue
-        full_path = os.path.join(path, file.filename)
-        open(full_path, 'w').write(file.read().decode('utf-8'))
+        save_file(file.stream, os.path.join(path, file.filename), errors)
     return 0
 
+def save_archive(stream, path):
+    with open(path, 'wb') as f: shutil.copyfileobj(stream, f, UPLOAD_CHUNK_BYTES)
+
+def save_file(stream, path, errors=UPLOAD_ERRORS):
+    # Streams an upload to disk as UTF-8 in fixed-size chunks, an incremental decoder handles
+    # characters split across chunks, so memory stays flat whatever the file size
+    decoder = codecs.getincrementaldecoder('utf-8')(errors)
+    try:
+        with open(path + ".part", 'w', encoding='utf-8') as f:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_BYTES), b""): f.write(decoder.decode(chunk))
+            f.write(decoder.decode(b"", final=True))
+    except UnicodeDecodeError as e:
+        os.remove(path + ".part")
+        print(f"\033[91;1m{os.path.basename(path)} \t SKIPPED\033[0m\t {e}")
+        return False
+    os.replace(path + ".part", path)
+    return True
+
 def delete_files(files, path):
     for file in files:
         file_name = file if isinstance(file, str) else file.filename
@@ -1,29 +1,112 @@
 # First Party
+import importlib
 import os
+import re
+import shutil
+import subprocess
+import sys
 from os.path import join as pjoin
 from collections import Counter
+from importlib.metadata import PackageNotFoundError, version
+from typing import NamedTuple
 import json
 
 # Third Party
 import pandas as pd
-import spacy
 
 # Local
-from .params import DELIM, PATH, DEFAULT
+from .params import DELIM, PATH, DEFAULT, Profile, make_profile
+from .cache import hash_bytes, hash_files, lookup, store
+from .utils import time_execution
 
 # Built-in rules
 BLACKLIST_WORDS = {"continue", "cont.", "continued"}
 KEYWORD_POS_TAGS = {'NOUN', 'PROPN', 'VERB', 'ADJ', 'ADV'}
 
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    os.system("python -m spacy download en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
+# POS Tagging, loaded on first use so importing the analysis layer stays cheap
+SPACY_MODEL = "en_core_web_sm"
+# Only the tagger is needed, attribute_ruler maps its fine tags to the coarse POS tags above
+SPACY_EXCLUDE = ["parser", "lemmatizer", "ner"]
+LEXICON_PATH = PATH['ROOT'] / 'data' / 'pos_lexicon.json'
+R_TOKEN = re.compile(r"\w+|[^\w\s]")
+# Closed word classes for the lexicon tagger, any other word is treated as a noun
+CLOSED_CLASS = {
+    **dict.fromkeys(("a", "an", "the", "this", "that", "these", "those", "each", "every", "any", "all",
+                     "some", "no", "its", "their", "our", "his", "her"), "DET"),
+    **dict.fromkeys(("of", "in", "on", "at", "by", "for", "with", "to", "from", "into", "under", "over",
+                     "between", "among", "about", "as", "upon", "within", "through", "during"), "ADP"),
+    **dict.fromkeys(("and", "or", "nor", "but", "&"), "CCONJ"),
+    **dict.fromkeys(("if", "whether", "because", "while", "although"), "SCONJ"),
+    **dict.fromkeys(("it", "we", "they", "he", "she", "you", "i", "us", "them"), "PRON"),
+    **dict.fromkeys(("is", "are", "was", "were", "be", "been", "has", "have", "had", "will", "shall",
+                     "may", "can", "should", "would"), "AUX"),
+    **dict.fromkeys(("not",), "PART"),
+}
+_NLP = None
+# Bump when analysis changes so cached metrics from older code are not reused
+ANALYSIS_VERSION = 1
+METRIC_FILES = ('title_keywords.json', 'constants.json')
+
+class Token(NamedTuple):
+    text: str
+    pos_: str
+
+
+class LexiconTagger:
+    # Opt-in dictionary tagger for offline deployments, with the slice of the spaCy interface tally_keywords uses
+    def __init__(self, lexicon: dict | None = None):
+        self.lexicon = {**CLOSED_CLASS, **(lexicon or {})}
+
+    def __call__(self, text: str) -> list[Token]:
+        return [Token(word, self.tag(word)) for word in R_TOKEN.findall(text)]
+
+    def pipe(self, texts, batch_size: int = 1000, n_process: int = 1):
+        for text in texts: yield self(text)
+
+    def tag(self, word: str) -> str:
+        if word.lower() in self.lexicon: return self.lexicon[word.lower()]
+        if word.isdigit():      return "NUM"
+        if not word.isalnum():  return "PUNCT"
+        return "NOUN"
 
 # *********************
 # HELPER FUNCTIONS
 # *********************
+def get_nlp():
+    global _NLP
+    if _NLP is None: _NLP = load_tagger()
+    return _NLP
+
+def load_tagger():
+    # The lexicon tagger scores keywords differently, so it is only used when configured
+    if DEFAULT["POS_TAGGER"] == "lexicon": return load_lexicon()
+    try:
+        import spacy
+        try: return spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)
+        except OSError: subprocess.run([sys.executable, "-m", "spacy", "download", SPACY_MODEL])
+        importlib.invalidate_caches()
+        return spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)
+    except (ImportError, OSError) as e:
+        raise RuntimeError(f"spaCy model {SPACY_MODEL} could not be loaded, install it or set "
+                           f"POS_TAGGER to \"lexicon\" in params.py: {e}") from e
+
+def tagger_name() -> str:
+    # Names the configured tagger from installed versions and files without loading it, so cache hits
+    # never import spaCy. A model upgrade or lexicon edit changes the keyword scores
+    if DEFAULT["POS_TAGGER"] == "lexicon":
+        lexicon = b""
+        if os.path.exists(LEXICON_PATH):
+            with open(LEXICON_PATH, 'rb') as f: lexicon = f.read()
+        return "lexicon:" + hash_bytes(lexicon, json.dumps(CLOSED_CLASS, sort_keys=True))
+    try: return f"spacy:{version('spacy')}:{SPACY_MODEL}:{version(SPACY_MODEL)}"
+    except PackageNotFoundError: return f"spacy:{SPACY_MODEL}:missing"
+
+def load_lexicon():
+    lexicon = None
+    if os.path.exists(LEXICON_PATH):
+        with open(LEXICON_PATH) as f: lexicon = json.load(f)
+    return LexiconTagger(lexicon)
+
 def get_files(path, label, exts):
     files = []
     for root, _, filenames in os.walk(path):
@@ -75,31 +158,31 @@ def max_without_outliers(data, column=None, factor=1.5):
 # CORE ANALYSIS FUNCTIONS
 # *********************
 def tally_keywords(df: pd.DataFrame):
-    n_words, keywords = [], []
-    for title in df['Start_Title']:
-        
-        # Guard Clause
-        if pd.isnull(title):
-            n_words.append(0)
-            keywords.append(Counter())
-            continue
-        n_words.append(len(title.split(DELIM['WORD'])))
-        # Tally Keywords & Counter filters
-        counts = Counter()
+    titles = df['Start_Title'].tolist()
+    n_words = [0 if pd.isnull(title) else len(title.split(DELIM['WORD'])) for title in titles]
+    keywords = [Counter() for _ in titles]
 
-        for token in nlp(title):
+    # Tag all titles in batches, null titles keep an empty tally
+    rows = [i for i, title in enumerate(titles) if not pd.isnull(title)]
+    docs = get_nlp().pipe((titles[i] for i in rows), batch_size=DEFAULT["NLP_BATCH_SIZE"],
+                          n_process=DEFAULT["NLP_N_PROCESS"])
+    for i, doc in zip(rows, docs):
+        # Tally Keywords & Counter filters
+        counts = keywords[i]
+        for token in doc:
             if token.pos_ not in KEYWORD_POS_TAGS: continue
             if token.text in {".", ",", ":", ";", "-"}: continue
             if token.text in BLACKLIST_WORDS: continue
             counts[token.text] += 1
-        keywords.append(counts)
         
     tallies = pd.DataFrame({'n_words': n_words, 'keywords': keywords})
     return tallies
 
 
 def score_keywords(tallies: pd.DataFrame, metric_path):
-    total_keyword_tallies = sum(tallies['keywords'], Counter())
+    # Merged in place, summing Counters copies the running total for every label
+    total_keyword_tallies = Counter()
+    for counts in tallies['keywords']: total_keyword_tallies.update(counts)
     median_n_words = tallies['n_words'].median()
 
     # Filter and compute relative frequencies
@@ -122,19 +205,51 @@ def compute_constants(dataset, tallies):
     print(f"Max n_words:        {max_n_words}")
     print(f"Max section size:   {max_section_size}")
 
-    DEFAULT['MAX_SECT_SIZE'] = max_section_size
-    DEFAULT['MAX_LINE_SIZE'] = max_n_words
+    return {'MAX_SECT_SIZE': int(max_section_size), 'MAX_LINE_SIZE': float(max_n_words)}
+
+
+def save_constants(constants: dict, metric_path):
+    with open(pjoin(metric_path, 'constants.json'), 'w') as f: json.dump(constants, f)
+
+
+def load_cached_metrics(key: str, metric_path) -> dict | None:
+    entry = lookup('metrics', key)
+    if entry is None: return None
+    for file in METRIC_FILES: shutil.copy(entry / file, pjoin(metric_path, file))
+    with open(entry / 'constants.json') as f: return json.load(f)
+
+
+def store_cached_metrics(key: str, metric_path):
+    contents = {}
+    for file in METRIC_FILES:
+        with open(pjoin(metric_path, file), 'rb') as f: contents[file] = f.read()
+    store('metrics', key, contents, DEFAULT["METRICS_CACHE_BYTES"])
 
 # *********************
 # ENTRY FUNCTIONS
 # *********************
-def analysis_entry(labels_path, metric_path, label_word, exts=[".txt"]):
+@time_execution
+def analysis_entry(labels_path, metric_path, label_word, exts=[".txt"]) -> Profile:
     print("Analyzing files...")
     files = get_files(labels_path, label_word, exts)
+
+    # Repeat uploads of the same labels reuse the stored keyword scores and constants
+    tagger = tagger_name()
+    key = hash_files(files, label_word, ANALYSIS_VERSION, tagger)
+    constants = load_cached_metrics(key, metric_path)
+    if constants is not None: 
+        print("Using cached analysis")
+        return make_profile(**constants)
+
     dataset = gen_dataset(files, label_word, metric_path, labels_path)
     tallies = tally_keywords(dataset)
-    compute_constants(dataset, tallies)
+    constants = compute_constants(dataset, tallies)
     score_keywords(tallies, metric_path)
+    save_constants(constants, metric_path)
+    # A model downloaded by this run is stored under its installed version
+    if tagger_name() != tagger: key = hash_files(files, label_word, ANALYSIS_VERSION, tagger_name())
+    store_cached_metrics(key, metric_path)
+    return make_profile(**constants)
 
 if __name__ == '__main__':
     analysis_entry("/Users/sharjeelmustafa/Desktop/LABELS", "Extracted", [".txt"])
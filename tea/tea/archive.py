@@ -0,0 +1,112 @@
+# Result archives written incrementally, sections go from memory straight into the zip
+# so a job never writes, re-reads and deletes a file per result.
+# Uploaded archives are read member by member, nothing is unpacked to disk
+
+# First Party
+import os
+import shutil
+import tarfile
+import zipfile
+from functools import lru_cache
+from typing import NamedTuple
+
+# Local
+from .params import DEFAULT
+
+# *********************
+# CONST & VARIABLES
+# *********************
+ARCHIVE_EXTS = ('.zip', '.tar.gz', '.tgz')
+
+
+# *********************
+# ARCHIVE CLASSES
+# *********************
+class Member(NamedTuple):
+    # A zip member, passed to a worker by name and opened there so its bytes never cross processes
+    archive: str
+    name: str
+
+
+class ResultArchive:
+    # Level 0 stores entries uncompressed, 1-9 are deflate levels
+    def __init__(self, path, level: int=None):
+        level = DEFAULT["ZIP_LEVEL"] if level is None else level
+        compression = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+        self.path = path
+        self.zip = zipfile.ZipFile(path, 'w', compression, compresslevel=level or None)
+
+    def add(self, name: str, data: str | bytes):
+        self.zip.writestr(name, data)
+
+    def merge(self, path):
+        # Appends every entry of another archive, e.g. a shard's part, at this archive's level
+        with zipfile.ZipFile(path) as part:
+            for info in part.infolist():
+                with part.open(info) as src, self.zip.open(info.filename, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# *********************
+# UPLOAD FUNCTIONS
+# *********************
+def is_archive(path) -> bool:
+    return str(path).lower().endswith(ARCHIVE_EXTS)
+
+
+def is_zip(path) -> bool:
+    return str(path).lower().endswith('.zip')
+
+
+def is_member(name: str, exts, exclude: str=None, include: str=None) -> bool:
+    # Filters on the member's file name, macOS metadata (__MACOSX/._name) and other hidden files are skipped
+    base = os.path.basename(name)
+    if not base or base.startswith('.') or not base.endswith(tuple(exts)): return False
+    if exclude and exclude in base: return False
+    return not include or include in base
+
+
+def list_members(path, select) -> list[str]:
+    # A zip lists its central directory, a tar.gz is read through as headers are spread over the stream
+    if is_zip(path):
+        with zipfile.ZipFile(path) as zf:
+            return [info.filename for info in zf.infolist() if not info.is_dir() and select(info.filename)]
+    with tarfile.open(path, 'r|gz') as tf: return [i.name for i in tf if i.isfile() and select(i.name)]
+
+
+def iter_members(path, select):
+    # Yields (member, data) one member at a time, so memory is bounded by the largest member
+    if is_zip(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and select(info.filename): yield info.filename, zf.read(info)
+        return
+    with tarfile.open(path, 'r|gz') as tf:
+        for info in tf:
+            if info.isfile() and select(info.name): yield info.name, tf.extractfile(info).read()
+
+
+# *********************
+# MEMBER FUNCTIONS
+# *********************
+@lru_cache(maxsize=8)
+def open_zip(path) -> zipfile.ZipFile:
+    # Kept open per worker process, so the central directory is read once rather than per member
+    return zipfile.ZipFile(path)
+
+
+def open_member(member: Member):
+    return open_zip(member.archive).open(member.name)
+
+
+def member_size(member: Member) -> int:
+    return open_zip(member.archive).getinfo(member.name).file_size
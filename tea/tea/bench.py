@@ -0,0 +1,195 @@
+# Benchmark harness for the parse -> analyze -> extract pipeline
+# Generates a deterministic synthetic EDGAR corpus, times each layer and writes the results to JSON
+
+# First Party
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from os.path import join as pjoin
+from pathlib import Path
+
+# Local
+from .analysis import analysis_entry
+from .extract import extraction_entry
+from .params import PATH
+from .parse import parse_entry
+
+# *********************
+# CONST & VARIABLES
+# *********************
+LABEL_WORD = "Extracted"
+SIZES = [20, 100, 500]
+WORDS = ("fund shares trust board directors adviser portfolio investment management fees expenses annual "
+         "report securities market value net assets period ended the of and to in for with by on as per "
+         "common stock dividend income capital gain loss approval").split()
+TITLES = ["Investment Advisory Agreement", "Board Approval of Investment Advisory Agreement",
+          "Approval of the Investment Advisory Agreement", "Management Agreement",
+          "Investment Sub-Advisory Agreement Approval"]
+OTHER_TITLES = ["Financial Highlights", "Notes to Financial Statements", "Schedule of Investments",
+                "Report of Independent Registered Public Accounting Firm", "Trustees and Officers",
+                "Portfolio Managers", "Expense Example", "Tax Information"]
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+# *********************
+# GENERATOR FUNCTIONS
+# *********************
+def make_sentence(r: random.Random) -> str:
+    words = [r.choice(WORDS) for _ in range(r.randint(6, 22))]
+    return " ".join(words).capitalize() + "."
+
+
+def make_paragraph(r: random.Random) -> str:
+    return " ".join(make_sentence(r) for _ in range(r.randint(2, 6)))
+
+
+def make_filing(r: random.Random, html: bool, n_sections: int) -> tuple[str, str]:
+    # Returns the filing and its label, the target section sits between n_sections other sections
+    def section(title, lo, hi): return title, [make_paragraph(r) for _ in range(r.randint(lo, hi))]
+    title = r.choice(TITLES)
+    sections = [section(r.choice(OTHER_TITLES), 2, 5) for _ in range(n_sections)]
+    sections += [section(title, 3, 8)] + [section(r.choice(OTHER_TITLES), 2, 5) for _ in range(n_sections)]
+    label = title + "\n" + "\n".join(dict(sections)[title]) + "\n"
+    toc = [t for t, _ in sections]
+
+    if not html:
+        # The filler pushes the sections past the table of contents skip
+        out = ["FORM N-CSR\n\n", "TABLE OF CONTENTS\n\n" + "\n".join(toc) + "\n\n", ("filler " * 12 + "\n") * 140 + "\n"]
+        for t, paragraphs in sections: out += [f"{t}\n\n"] + [p + "\n\n" for p in paragraphs] + ["<PAGE>\n\n"]
+        return "".join(out), label
+
+    out = ["<SEC-DOCUMENT>\n<DOCUMENT>\n<TYPE>N-CSR\n<TEXT>\n<html><body>\n",
+           "<div><p>TABLE OF CONTENTS</p>" + "".join(f"<div>{t}</div>" for t in toc) + "</div>\n",
+           "<div>" + "x " * 6000 + "</div>\n"]
+    for t, paragraphs in sections:
+        out.append(f'<div style="margin-top:12pt"><font size="2"><b>{t}</b></font></div>\n')
+        for p in paragraphs:
+            first, _, rest = p.partition(". ")
+            out.append(f'<p style="text-align: justify">{first}<sup>1</sup>. {rest}<br>\n</p>\n')
+        out.append('<table><tr><td style="width:50%">Col&nbsp;A</td><td>12</td></tr></table>\n<div>&#160;</div>\n')
+    out.append("</body></html>\n</TEXT>\n</DOCUMENT>\n")
+    out.append("<DOCUMENT>\n<TYPE>GRAPHIC\n<SEQUENCE>2\nbegin 644 chart.jpg\nM<br>xx<div>\n</DOCUMENT>\n</SEC-DOCUMENT>\n")
+    return "".join(out), label
+
+
+def generate_corpus(root: str, n_docs: int, n_sections: int=3, seed: int=0) -> list[str]:
+    # Alternates SEC HTML and plain text filings, the same seed always gives the same corpus
+    r = random.Random(seed)
+    os.makedirs(pjoin(root, 'texts'), exist_ok=True)
+    os.makedirs(pjoin(root, 'labels'), exist_ok=True)
+    names = []
+    for i in range(n_docs):
+        html = i % 2 == 0
+        name = f"{i:010d}-11-{i:06d}"
+        text, label = make_filing(r, html, n_sections)
+        with open(pjoin(root, 'texts', name + (".htm" if html else ".txt")), 'w') as f: f.write(text)
+        with open(pjoin(root, 'labels', f"{name}_{LABEL_WORD}.txt"), 'w') as f: f.write(label)
+        names.append(name)
+    return names
+
+
+# *********************
+# HELPER FUNCTIONS
+# *********************
+def folder_size(path: str) -> int:
+    return sum(os.path.getsize(pjoin(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def peak_rss() -> dict:
+    # High-water marks of the calling process, children covers the extraction workers once they have exited
+    return {
+        "peak_rss_mb":          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 1e6,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * RSS_UNIT / 1e6,
+    }
+
+
+def run_stage(cache_path, func, *args, **kwargs) -> dict:
+    # Runs in a fresh interpreter, so the high-water marks belong to this stage alone
+    PATH['CACHE'] = cache_path
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return {"seconds": time.perf_counter() - start, **peak_rss()}
+
+
+def measure(func, n_docs: int, n_bytes: int, *args, **kwargs) -> dict:
+    # ru_maxrss never goes down, so each stage is spawned rather than forked from a process that ran earlier ones
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        stage = executor.submit(run_stage, PATH['CACHE'], func, *args, **kwargs).result()
+    seconds = stage.pop("seconds")
+    return {"seconds": round(seconds, 4), "docs": n_docs, "mb": round(n_bytes / 1e6, 3),
+            "docs_per_sec": round(n_docs / seconds, 2), "mb_per_sec": round(n_bytes / 1e6 / seconds, 3),
+            **stage}
+
+
+# *********************
+# MAIN FUNCTIONS
+# *********************
+def bench_size(root: str, n_docs: int, workers: int=None, stream: bool=False, seed: int=0) -> dict:
+    names = generate_corpus(root, n_docs, seed=seed)
+    texts, labels = pjoin(root, 'texts'), pjoin(root, 'labels')
+    metrics, results = pjoin(root, 'metrics'), pjoin(root, 'results')
+    os.makedirs(metrics, exist_ok=True)
+    os.makedirs(results, exist_ok=True)
+    stages = {}
+
+    # Stream mode parses inside the extraction workers, so there is no separate parse stage
+    raw_bytes = folder_size(texts)
+    if not stream:
+        stages["parse"] = measure(parse_entry, n_docs, raw_bytes, input_path=texts, output_path=texts,
+                                  mask=names, label=LABEL_WORD, ext=['.txt', '.htm'])
+    stages["analysis"] = measure(analysis_entry, n_docs, folder_size(labels), labels, metrics, LABEL_WORD)
+    stages["extraction"] = measure(extraction_entry, n_docs, raw_bytes if stream else folder_size(texts),
+                                   texts, metrics, labels, results, LABEL_WORD, mask=names,
+                                   exts=['.txt', '.htm'] if stream else ['.txt'], test=True, workers=workers,
+                                   stream=stream)
+    return {"docs": n_docs, "raw_mb": round(raw_bytes / 1e6, 3), "stages": stages}
+
+
+def run_benchmark(sizes=SIZES, output=None, workers=None, stream=False, seed=0, tag=None) -> dict:
+    report = {"tag": tag, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "cpu_count": os.cpu_count(), "workers": workers,
+              "stream": stream, "seed": seed, "results": []}
+
+    # Analysis, parse and extraction results are cached by content. Each corpus starts with the
+    # documents of the smaller ones, so every size gets its own scratch cache to keep its run cold
+    cache_path = PATH['CACHE']
+    with tempfile.TemporaryDirectory(prefix="tea_bench_") as scratch:
+        try:
+            for n_docs in sizes:
+                PATH['CACHE'] = Path(scratch) / f"cache_{n_docs}"
+                root = pjoin(scratch, f"corpus_{n_docs}")
+                report["results"].append(bench_size(root, n_docs, workers, stream, seed))
+                shutil.rmtree(root, ignore_errors=True)
+        finally: PATH['CACHE'] = cache_path
+
+    output = output or PATH['ROOT'] / 'data' / 'bench' / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {output}")
+    return report
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Text Extractor Benchmark')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=SIZES, help="Corpus sizes in documents")
+    parser.add_argument('-o', '--output', type=str, help="Path of the JSON results file")
+    parser.add_argument('-w', '--workers', type=int, help="Extraction worker processes")
+    parser.add_argument('--seed', type=int, default=0, help="Corpus generator seed")
+    parser.add_argument('--tag', type=str, help="Label stored with the results, e.g. a commit")
+    parser.add_argument('--stream', action='store_true', help="Parse inside the extraction workers")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    run_benchmark(args.sizes, args.output, args.workers, args.stream, args.seed, args.tag)
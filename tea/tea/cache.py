@@ -0,0 +1,97 @@
+# Content-addressed on-disk caches, each entry is a directory named by its key
+# and entries are evicted least recently used first once a cache exceeds its size
+
+# First Party
+import hashlib
+import os
+import shutil
+
+# Local
+from .params import PATH
+
+
+# *********************
+# HELPER FUNCTIONS
+# *********************
+def hash_bytes(data: bytes, *extra) -> str:
+    digest = hashlib.sha256()
+    for item in extra: digest.update(f"{item}\0".encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_stream(f, *extra) -> str:
+    # Keyed on contents alone, read in chunks as filings can be large. Same key as hash_bytes
+    digest = hashlib.sha256()
+    for item in extra: digest.update(f"{item}\0".encode())
+    for chunk in iter(lambda: f.read(1 << 20), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path, *extra) -> str:
+    with open(path, 'rb') as f: return hash_stream(f, *extra)
+
+
+def hash_files(files, *extra) -> str:
+    # Keyed on file names and contents, plus any settings that change the cached result
+    digest = hashlib.sha256()
+    for item in extra: digest.update(f"{item}\0".encode())
+    for file in sorted(files, key=os.path.basename):
+        digest.update(f"{os.path.basename(file)}\0".encode())
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_path(name: str):
+    path = PATH['CACHE'] / name
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def entry_size(entry) -> int:
+    return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+
+# *********************
+# CACHE FUNCTIONS
+# *********************
+def lookup(name: str, key: str):
+    entry = get_cache_path(name) / key
+    if not entry.is_dir(): return None
+    # Modification time records the last use for eviction, an entry evicted meanwhile is a miss
+    try: os.utime(entry)
+    except FileNotFoundError: return None
+    return entry
+
+
+def store(name: str, key: str, contents: dict, max_bytes: int=None):
+    # Written to a temporary directory first so readers never see a partial entry.
+    # Without max_bytes the caller evicts, e.g. once per job rather than per entry
+    path = get_cache_path(name)
+    temp = path / f".{key}.{os.getpid()}"
+    os.makedirs(temp, exist_ok=True)
+    for file_name, data in contents.items():
+        with open(temp / file_name, 'wb') as f: f.write(data)
+    try: os.replace(temp, path / key)
+    except OSError: shutil.rmtree(temp, ignore_errors=True)  # Stored concurrently by another job
+    return 0 if max_bytes is None else evict(name, max_bytes)
+
+
+def evict(name: str, max_bytes: int) -> int:
+    path = get_cache_path(name)
+    entries = []
+    for key in os.listdir(path):
+        if key.startswith('.'): continue
+        entry = path / key
+        try: entries.append((os.path.getmtime(entry), entry_size(entry), entry))
+        except FileNotFoundError: continue
+
+    # Oldest entries go first until the cache fits
+    total, evicted = sum(size for _, size, _ in entries), 0
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes: break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        evicted += 1
+    return evicted
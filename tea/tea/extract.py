@@ -2,115 +2,128 @@
 
 # First Party
 import argparse
+import json
 import os
 import re
+import time
 import concurrent.futures
 from collections import Counter
-from typing import List
-from multiprocessing import Manager
+from functools import lru_cache, partial
+from itertools import chain
+from typing import List, NamedTuple
 from os.path import join as pjoin
 
-# Third Party
-import pandas as pd
-
 # Local
-from .utils import time_execution, convert_to_series, metrics
-from .tests import overlap_similarity
-from .parse import get_files
-from .params import PATH, DEFAULT, DELIM
+from .utils import time_execution, convert_to_series, metrics, pipeline
+from .archive import Member, open_member
+from .cache import evict, hash_bytes, hash_file, hash_stream, lookup, store
+from .instrument import count, profile_call, record_document
+from .tests import batch_overlap, hash_sentences
+from .parse import PARSER_VERSION, get_files, parse_file, parse_source, source_name, source_size
+from .params import PATH, DEFAULT, DELIM, Profile, load_profile
 
 
 # *********************
 # VARIABLE DECLARATIONS
 # *********************
 TITLE, SCORE = 0, 1
-# Main and fine-grained regex patterns
-R_TITLE = r"^\s*\w(?:\w*[ (&,\'\’\w)-]++|(?<=\(\w))+(?:\(\w*\))?[:;]?$"
-R_TITLE_FRAGMENT = r"^\s*\w(?:\w*[ (&,\'\’\w)-]++|(?<=\(\w))+(?:\(\w*\))?:"
-R_NO_NUM = r"^\D.*\D$"
-R_SENTENCE = r"^(\w+\s\w+\s\w+\s?)((\w+|-)\s?)*"
-RM_PAGE = r"<PAGE>"
+# Main and fine-grained regex patterns, compiled once per process
+R_TITLE = re.compile(r"^\s*\w(?:\w*[ (&,\'\’\w)-]++|(?<=\(\w))+(?:\(\w*\))?[:;]?$")
+R_TITLE_FRAGMENT = re.compile(r"^\s*\w(?:\w*[ (&,\'\’\w)-]++|(?<=\(\w))+(?:\(\w*\))?:")
+R_NO_NUM = re.compile(r"^\D.*\D$")
+# Only the start of a sentence decides a match, the optional remainder of the old pattern is not scanned
+R_SENTENCE = re.compile(r"\w+\s\w+\s\w+")
+RM_PAGE = re.compile(r"<PAGE>")
+R_SPACES = re.compile(r"\s+")
+# Plain text blocks are paragraphs, SEC HTML output has a block per non-empty line
+R_PARAGRAPH_END, R_LINE = re.compile(r"\n\n"), re.compile(r"[^\n]+")
+# Reused sections are keyed by the raw filing, these profile values, the keywords and this version.
+# Bump the version whenever a parse or extraction change alters the sections
+EXTRACTOR_VERSION = 1
+SECTION_PARAMS = ("N_TOP_TITLES", "TOC_SKIP_CHARS", "MAX_SECT_SIZE", "MAX_LINE_SIZE", "REPEATABLE_KEYWORDS",
+                  "SPECIAL_PHRASES")
+RESULT_CACHE, SECTION_FILE = "results", "section.txt"
 # Global Control Variables
 LOG_MODE = False
+# Per-process state, populated once per worker by init_worker
+WORKER_STATE = {}
+
+
+class KeywordIndex(NamedTuple):
+    words: frozenset    # Title keywords, for membership checks
+    scores: dict        # Keyword -> median word frequency score
+
+
+class Document(NamedTuple):
+    # Read once per file and shared by titling, sectioning and scoring
+    name: str           # File name without extension
+    text: str           # Text after the table of contents skip, GRAPHIC cut and page marker removal
+    sec_html: bool      # Parsed from SEC HTML, so every line is a block
 
 # *********************
 #  EXTRACTIONS FUNCTIONS
 # *********************
-def extract_titles(file_path: str, metric_path: str, delimiter: str = '\n'):
-    # Input validation and Guard Clause
-    text, sec_html = get_text(file_path)
-    text = re.sub(RM_PAGE, "", text)
-    if text is None: return
-    input_path = pjoin(metric_path, 'title_keywords.json')
-    keyword_dataset =  pd.read_json(input_path)
-
-    # Slices Document into "coarse titles"
-    titles, idx, raws = [], [], []
-    delim = delimiter if sec_html else "\n\n"
-    for i, line in enumerate(text.split(delim)):
-        raw = line
-        if not sec_html:
-            line = re.sub(r'[\n\t\r]', ' ', line)
-            line = re.sub(r'\s+', ' ', line)
-        title = get_title(line, keyword_dataset)
+def extract_titles(doc: Document, keywords: KeywordIndex, profile: Profile, stats: dict=None):
+    # Slices Document into "coarse titles", kept with the offset the section starts from
+    titles, offsets, blocks = [], [], 0
+    for start, line in scan_blocks(doc, profile):
+        blocks += 1
+        if not doc.sec_html: line = R_SPACES.sub(' ', line)
+        title = get_title(line, keywords, profile)
         if title is None: continue
+        # SEC HTML sections start at the title, plain text sections at the raw block
+        if doc.sec_html: start += len(line) - len(line.lstrip())
         titles.append(title)
-        idx.append(i)
-        raws.append(raw)
-
+        offsets.append(start)
 
     # Extracts "fine-grain titles" from "coarse titles" (can be used to determine end titles too)
-    candidate_titles, titles, idx = extract_candidiates(titles, idx, keyword_dataset)
+    candidate_titles, _, _ = extract_candidiates(titles, offsets, keywords, profile)
+    if stats is not None: stats.update(blocks=blocks, titles=len(titles), candidates=len(candidate_titles))
     if LOG_MODE:
-        output = f"File: {os.path.basename(file_path)}\n"
+        output = f"File: {doc.name}\n"
         output += "\n\033[93;1mCANDIDATE TITLE SCORES\033[0m\n"
         output += "\n".join(f"{score[0]} \t {title}" for title, score in candidate_titles)
         print(output)
         
-    return candidate_titles, titles, raws
+    return candidate_titles
 
 
-def extract_candidiates(titles: List[str], idx: List[int], dataset: pd.DataFrame, 
+def extract_candidiates(titles: List[str], offsets: List[int], keywords: KeywordIndex, profile: Profile,
                         default_order: bool=False) -> List[str]:
-    MED_W_FREQ, scores = 1, {}
-    for title, block in zip(titles, idx):
+    scores = {}
+    for title, offset in zip(titles, offsets):
+        # A repeated title keeps the offset of its first block
+        if title in scores: continue
         # Count words in the title
         words = Counter(word.strip().lower() for word in title.split(DELIM["WORD"]) 
-                        if word.strip().lower() in dataset and word not in {'-', '.'})
-        val = 0 # Use dataset to compute scores
+                        if word.strip().lower() in keywords.words and word not in {'-', '.'})
+        val = 0 # Use keyword scores to compute title score
         for word, count in words.items(): 
-            val += dataset[word][MED_W_FREQ] * count
-        scores.update({title: [round(val, 2), block]})
+            val += keywords.scores[word] * count
+        scores.update({title: [round(val, 2), offset]})
     # with open(f'{general["ROOT"]}data/{out_file}.json', 'w') as f: json.dump(scores, f)
     if default_order: return [(title, score) for title, score in scores.items()]
 
     # Sort and take top titles (we already take the top scored titles)
     sorted_scores = sorted(scores.items(), key=lambda x: x[1][0], reverse=True)
-    top_titles = [(title, score) for title, score in sorted_scores[:DEFAULT["N_TOP_TITLES"]]]
-    return top_titles, titles, idx
-
+    top_titles = [(title, score) for title, score in sorted_scores[:profile["N_TOP_TITLES"]]]
+    return top_titles, titles, offsets
 
-def extract_section(file_path: str, start_title: str, titles: List[str], raws: List[str], 
-                    unit: str='line', line_length: int = 100) -> str:
-    text, sec_html = get_text(file_path)
-    if not sec_html:
-        i = titles.index(start_title)
-        start_title = raws[i]
-    start_index = text.find(start_title)
-    text = text[start_index:]
 
+def extract_section(doc: Document, offset: int, profile: Profile, unit: str='line', line_length: int = 100) -> str:
+    # Sections start at the candidate title's offset, only the section itself is sliced
     if unit == 'line':
-        end_index = line_length * DEFAULT["MAX_SECT_SIZE"]
-        return text[:end_index]
+        end_index = line_length * profile["MAX_SECT_SIZE"]
+        return doc.text[offset:offset + end_index]
     
     elif unit == 'sentence':
         sentence_count, end_index = 0, 0
-        for sentence in text.split(DELIM["SENTENCE"]):
-            if re.match(R_SENTENCE, sentence): 
+        for sentence in iter_sentences(doc.text, offset):
+            if R_SENTENCE.match(sentence): 
                 sentence_count += 1
                 end_index += len(sentence) + 1
-            if sentence_count == DEFAULT["MAX_SECT_SIZE"]: break
-        return text[:end_index]
+            if sentence_count == profile["MAX_SECT_SIZE"]: break
+        return doc.text[offset:offset + end_index]
     
     return None
 
@@ -118,73 +131,128 @@ def extract_section(file_path: str, start_title: str, titles: List[str], raws: L
 # *********************
 # HELPER FUNCTIONS
 # *********************
-def get_text(file_path: str) -> str:
-    if file_path.endswith('.txt'): 
-        txt = open(file_path, 'r').read()
-        sec_html = True if "SEC_HTML" in txt[:100] else False
-        txt = txt[DEFAULT["TOC_SKIP_CHARS"]:]
-        i = txt.find("GRAPHIC")
-        if i != -1: txt = txt[:i]
-        return txt, sec_html
-
-def get_title(section: str, dataset: pd.DataFrame) -> str | None:
+def read_document(file_path: str) -> tuple[str, str]:
+    # Reads a persisted parse output as a (name, text) record
+    if not file_path.endswith('.txt'): raise ValueError("Parsed documents must be .txt files")
+    with open(file_path, 'r') as f: txt = f.read()
+    return os.path.splitext(os.path.basename(file_path))[0], txt
+
+def make_document(name: str, txt: str, profile: Profile) -> Document:
+    sec_html = True if "SEC_HTML" in txt[:100] else False
+    txt = txt[profile["TOC_SKIP_CHARS"]:]
+    i = txt.find("GRAPHIC")
+    if i != -1: txt = txt[:i]
+    return Document(name, RM_PAGE.sub("", txt), sec_html)
+
+def scan_blocks(doc: Document, profile: Profile):
+    # Yields (offset, block) for blocks that can hold a title, other blocks are never sliced
+    text = doc.text
+    if doc.sec_html:
+        # Lines are already whitespace normalized, get_title's own early rejects are cheaper than a prefilter
+        for line in R_LINE.finditer(text): yield line.start(), line.group()
+        return
+
+    # A title is the block, or its text up to the first colon, so blocks whose title region has
+    # too many words are skipped before they are normalized
+    region, start = title_region_pattern(max(int(profile["MAX_LINE_SIZE"]), 1)), 0
+    for end, next_start in chain((boundary.span() for boundary in R_PARAGRAPH_END.finditer(text)),
+                                 [(len(text), None)]):
+        colon = text.find(':', start, end)
+        if region.fullmatch(text, start, end if colon == -1 else colon + 1): yield start, text[start:end]
+        start = next_start
+
+def iter_sentences(text: str, start: int):
+    # Lazily yields the same pieces as text[start:].split(DELIM["SENTENCE"])
+    delim = DELIM["SENTENCE"]
+    end = text.find(delim, start)
+    while end != -1:
+        yield text[start:end]
+        start = end + len(delim)
+        end = text.find(delim, start)
+    yield text[start:]
+
+@lru_cache
+def title_region_pattern(max_words: int) -> re.Pattern:
+    # At most max_words whitespace separated words, as get_title counts them once normalized
+    return re.compile(rf"\s*+\w\S*+(?:\s++\S++){{0,{max_words - 1}}}+\s*+")
+
+def load_keywords(metric_path: str) -> KeywordIndex:
+    # Keyword file maps each word to [count, median word frequency]
+    with open(pjoin(metric_path, 'title_keywords.json')) as f: dataset = json.load(f)
+    return KeywordIndex(frozenset(dataset), {word: values[1] for word, values in dataset.items()})
+
+def get_title(section: str, keywords: KeywordIndex, profile: Profile) -> str | None:
     # Multiples rule are applied to filter out invalid titles
     # e.g., title length, punctuation, and structure
     section = section.strip()
-    candidate_title = re.match(R_TITLE, section)
-    if not candidate_title and section and section[-1] != '.':
-        candidate_title = re.match(R_TITLE_FRAGMENT, section)
-    # Return None if no title found
-    if not candidate_title: return None
+    # Cheap rejects first. Neither pattern allows a colon before the end, so a title is the
+    # whole section or, as a fragment, everything up to the first colon
+    if not section or section[-1] == '.': return None
+    colon = section.find(':')
+    fragment = colon != -1 and colon != len(section) - 1
+    title = section[:colon + 1] if fragment else section
+    if title.count(DELIM["WORD"]) + 1 > profile["MAX_LINE_SIZE"]: return None
+    if title[-1] in {',', '-'}: return None
+
     # Title Filters
-    title = candidate_title.group(0)
-    if len(title.split(DELIM["WORD"])) > DEFAULT["MAX_LINE_SIZE"]: return None
-    if title[-1] in {'.', ',', '-'}: return None
-    candidate_title = re.match(R_NO_NUM, title.strip())
+    pattern = R_TITLE_FRAGMENT if fragment else R_TITLE
+    if not pattern.match(section) or not R_NO_NUM.match(title): return None
 
     # Remove special phrases before checking for repeated keywords
-    title = section.lower()
-    phrases = DEFAULT["SPECIAL_PHRASES"]
-    for phrase in phrases:
-        if phrase in title: title = title.replace(phrase, '')
-    
-    # Check for repeated keywords
-    keywords = dataset.columns.values
-    repeatable = DEFAULT["REPEATABLE_KEYWORDS"]
-    for w in title.strip().split(DELIM["WORD"]):
-        if title.count(w) == 1:         continue
-        if w.lower() not in keywords:   continue
-        if w.lower() not in repeatable: return None
-    
-    if candidate_title: return candidate_title.group(0)
+    section = section.lower()
+    for phrase in profile["SPECIAL_PHRASES"]:
+        if phrase in section: section = section.replace(phrase, '')
+
+    # Check for repeated keywords, only keywords are counted
+    repeatable = profile["REPEATABLE_KEYWORDS"]
+    words = Counter(w for w in section.split(DELIM["WORD"]) if w in keywords.words)
+    for w, count in words.items():
+        if count > 1 and w not in repeatable: return None
+    return title
 
 
 # *********************
 # ENTRY FUNCTIONS
 # *********************
-def extractor(file_path: str, metric_path: str, label_path: str, output_path: str,
-              test: bool=False, label: str='') -> float | None:
-    try:
-        candidate_titles, titles, raws = extract_titles(file_path, metric_path)
-        if not candidate_titles: 
-            print(f"\033[91;1m{file_path.split('/')[-1]} \t ERROR\033[0m\t No candidate titles found")
-            return None
-    
-        # Score the candidate titles and extract the best one, pick first index if tie
-        _, candidate_index = max((ct[SCORE][0], -i) for i, ct in enumerate(candidate_titles))
-        candidate_index = -candidate_index # Convert back to positive index
+def write_result(output_path: str, file_name: str, section: str) -> int:
+    path = pjoin(output_path, file_name)
+    with open(path, 'w') as f: f.write(section)
+    return os.path.getsize(path)
+
+
+def find_section(name: str, text: str, keywords: KeywordIndex, profile: Profile, stats: dict) -> str | None:
+    doc = make_document(name, text, profile)
+    candidate_titles = extract_titles(doc, keywords, profile, stats)
+    if not candidate_titles: 
+        print(f"\033[91;1m{name} \t ERROR\033[0m\t No candidate titles found")
+        stats['failure'] = "no_titles"
+        return None
+
+    # Score the candidate titles and extract the best one, pick first index if tie
+    _, candidate_index = max((ct[SCORE][0], -i) for i, ct in enumerate(candidate_titles))
+    candidate_index = -candidate_index # Convert back to positive index
 
-        # Extract the section of text between title and const
-        ct = candidate_titles[candidate_index][TITLE]
+    # Extract the section of text between title and const
+    _, offset = candidate_titles[candidate_index][SCORE]
+    return extract_section(doc, offset, profile, unit='line')
 
-        section = extract_section(file_path, ct, titles, raws, unit='line')
 
-        # Write the extracted section to a file, and read test for comparison
-        file = os.path.basename(file_path)[:-4]
-        name = f'{file}_{label}.txt'
+def extractor(name: str, text: str, keywords: KeywordIndex, profile: Profile, label_path: str, output_path: str,
+              test: bool=False, label: str='', stats: dict=None, write=None, section: str=None) -> tuple | None:
+    # Per-document stats are filled in when given, failures are recorded by reason.
+    # write(file_name, section) saves the section and returns its size, by default to a file in output_path.
+    # A section reused from the result cache is saved and scored without searching the text
+    stats = {} if stats is None else stats
+    write = write or partial(write_result, output_path)
+    start = time.perf_counter()
+    try:
+        if section is None: section = find_section(name, text, keywords, profile, stats)
+        if section is None: return None
+
+        # Write the extracted section, and hash its sentences for batch scoring
+        name = f'{name}_{label}.txt'
         label = pjoin(label_path, name)
-        pred = pjoin(output_path, name)
-        open(pred, 'w').write(section)
+        stats.update(bytes_written=write(name, section), extract_seconds=time.perf_counter() - start)
 
         # if LOG_MODE:
         #     print(f"Input_File: {file}")
@@ -196,47 +264,159 @@ def extractor(file_path: str, metric_path: str, label_path: str, output_path: st
         # If the label does not exist, return
         if not os.path.exists(label): 
             print("ERROR - Label file not found")
+            stats['failure'] = "no_label"
             return
 
-        # Compute and print similarity
-        similarity = overlap_similarity(label, pred)
-        score = round(similarity*100, 2)
-
-        # if score < DEFAULT["SUCCESS_THRESHOLD"]: 
-        #     open(f"{PATH['ROOT'] / 'data' / 'fails.txt'}", 'a').write(f"{file}\t{score}\n")
-        return score
+        # Sentence hashes are small to send back, the job's pairs are scored together
+        with open(label, 'r') as f: return hash_sentences(f.read()), hash_sentences(section)
 
     except Exception as e: 
-        print(f"\033[91;1m{file[:-4]} \t ERROR\033[0m\t {e}")
+        print(f"\033[91;1m{name} \t ERROR\033[0m\t {e}")
+        stats['failure'] = type(e).__name__
         return None
 
 
+def score_pairs(pairs: list) -> List[float]:
+    # Percent overlap per document, rounded as each document used to be
+    return [round(similarity*100, 2) for similarity in batch_overlap(pairs)]
+
+
+def result_key(metric_path, profile: Profile) -> str:
+    # The part of a result cache key shared by every document in the job, streamed
+    # documents are parsed in the worker so parser changes invalidate their sections too
+    with open(pjoin(metric_path, 'title_keywords.json'), 'rb') as f: keywords = f.read()
+    params = json.dumps({param: profile[param] for param in SECTION_PARAMS}, sort_keys=True)
+    return hash_bytes(keywords, EXTRACTOR_VERSION, PARSER_VERSION, params)
+
+
+def source_key(source, key: str) -> str:
+    # Files and zip members are hashed in chunks so large filings are never read whole,
+    # tar.gz members are already in memory
+    if isinstance(source, Member):
+        with open_member(source) as f: return hash_stream(f, key)
+    if isinstance(source, tuple): return hash_bytes(source[1], key)
+    return hash_file(source, key)
+
+
+def load_result(key: str) -> str | None:
+    entry = lookup(RESULT_CACHE, key)
+    if entry is None: return None
+    # Evicted by another job between the lookup and the read counts as a miss
+    try:
+        with open(entry / SECTION_FILE, encoding='utf-8', newline='') as f: return f.read()
+    except FileNotFoundError: return None
+
+
+def cache_write(write, key: str):
+    # Stores each section under its document's key as it is written, the job evicts once at the end
+    def cached(file_name, section):
+        store(RESULT_CACHE, key, {SECTION_FILE: section.encode()})
+        return write(file_name, section)
+    return cached
+
+
+def init_worker(keywords: KeywordIndex, profile: Profile, log: bool=False, result_key: str=None):
+    # Runs once per worker process, so the keyword index and profile are not resent per file
+    global LOG_MODE
+    LOG_MODE = log
+    WORKER_STATE['keywords'] = keywords
+    WORKER_STATE['profile'] = profile
+    WORKER_STATE['result_key'] = result_key
+
+
+def extract_worker(file_path: str, reader, label_path: str, output_path: str,
+                   test: bool=False, label: str='', profiling: bool=False, archive: bool=False) -> tuple:
+    # Profiling mode keeps cProfile and tracemalloc stats for documents over the job's thresholds
+    args = (file_path, reader, label_path, output_path, test, label, archive)
+    if not profiling: return extract_document(*args)
+    profile = WORKER_STATE['profile']
+    return profile_call(source_name(file_path), pjoin(output_path, 'profiles'), profile["PROFILING_SECONDS"],
+                        profile["PROFILING_PEAK_MB"] * 1e6, extract_document, *args)
+
+
+def extract_document(file_path: str, reader, label_path: str, output_path: str,
+                     test: bool=False, label: str='', archive: bool=False) -> tuple:
+    # The reader turns a path, or an uploaded archive member, into a (name, text) record, from disk or
+    # straight from the parser. Returns (name, result, stats, output), stats are recorded by the parent
+    # as workers have no recorder. In archive mode output is the (file_name, section) for the parent's
+    # archive, nothing is written here
+    name, stats, outputs, text = source_name(file_path), {}, [], None
+    def keep(file_name, section):
+        outputs.append((file_name, section))
+        return len(section.encode())
+    write = keep if archive else partial(write_result, output_path)
+
+    # An identical filing extracted before with the job's keywords and profile skips parsing and extraction.
+    # A source that can't be hashed is extracted without the cache, the reader then reports it
+    start, key, section = time.perf_counter(), WORKER_STATE['result_key'], None
+    if key:
+        try:
+            key = source_key(file_path, key)
+            section = load_result(key)
+            stats['result_cache'] = "miss" if section is None else "hit"
+        except Exception:
+            key, stats['result_cache'] = None, "error"
+
+    try:
+        if section is None: name, text = reader(file_path)
+        # In stream mode reading includes parsing the raw upload
+        stats.update(bytes_read=source_size(file_path), read_seconds=time.perf_counter() - start)
+    except Exception as e:
+        print(f"\033[91;1m{name} \t ERROR\033[0m\t {e}")
+        stats['failure'] = "read_error"
+        return name, None, stats, None
+    if key and section is None: write = cache_write(write, key)
+    result = extractor(name, text, WORKER_STATE['keywords'], WORKER_STATE['profile'], label_path, output_path,
+                       test, label, stats, write, section)
+    return name, result, stats, outputs[0] if outputs else None
+
+
 # *********************
 # MAIN FUNCTION
 # *********************
 args: argparse.Namespace
-def extraction_entry(texts_path, metric_path, label_path, output_path, label, mask, exts=['.txt'], log=False, test=True):
+def extraction_entry(texts_path, metric_path, label_path, output_path, label, mask, exts=['.txt'], log=False, test=True,
+                     workers=None, window=None, stream=False, profile=None, profiling=False, files=None, progress=None,
+                     archive=None, total=None):
+    # Callers that already walked the texts pass files, any iterable of paths or archive members with its
+    # total, progress(file_path, done, total) runs per document.
+    # Results go into archive as they arrive when one is given, otherwise to files in output_path
     print("Extracting files...")
-    # Setup and retrieve arguments
-    global LOG_MODE
-    LOG_MODE = log
+    # Stream mode parses raw uploads in the workers, otherwise persisted parse outputs are read
+    if files is None: files = get_files(texts_path, label=label, exts=exts, mask=mask)
+    reader = parse_source if stream else read_document
+    total = len(files) if total is None else total
+    if not total: return
+    keywords = load_keywords(metric_path)
+    # Analysis constants travel with the job, never through the module defaults
+    profile = profile or load_profile(metric_path)
+
+    # Extraction is CPU-bound regex work, so it is spread across processes, not threads
+    workers = min(workers or DEFAULT["N_WORKERS"] or os.cpu_count(), total)
+    window = window or workers * profile["SUBMIT_WINDOW"]
+    # Sections of filings seen before are reused while the result cache is enabled
+    key = result_key(metric_path, profile) if profile["RESULT_CACHE_BYTES"] else None
 
-    # Parse, prepare and retrieve files
-    files = get_files(texts_path, label=label, exts=exts, mask=mask)
     # Extract, save, and compute similarity
-    manager = Manager()
-    result_scores = manager.list()
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    worker = partial(extract_worker, reader=reader, label_path=label_path, output_path=output_path, test=test, label=label,
+                     profiling=profiling, archive=archive is not None)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(keywords, profile, log, key)) as executor:
         # Errors are returned as None
-        results = executor.map(extractor, files, [metric_path]*len(files), [label_path]*len(files), 
-                               [output_path]*len(files), [test]*len(files), [label]*len(files))
-        result_scores.extend([r for r in results if r is not None and r != -100.00])
+        pairs = []
+        for done, (file_path, (name, result, stats, output)) in enumerate(pipeline(executor, worker, files, window), 1):
+            record_document(name, stats)
+            if output: archive.add(*output)
+            if result is not None: pairs.append(result)
+            if progress: progress(file_path, done, total)
+    if key: count("result_cache_evictions", evict(RESULT_CACHE, profile["RESULT_CACHE_BYTES"]))
 
     # Convert to Series and compute metrics
     if not test: return
-    print("Files: ", len(result_scores))
-    result_scores = convert_to_series(result_scores)
-    metrics(result_scores)
+    print("Files: ", len(pairs))
+    scores = score_pairs(pairs)
+    metrics(convert_to_series(scores))
+    return scores
 
 # *********************
 # TEST FUNCTIONS
@@ -246,13 +426,31 @@ def test(file: str):
     global LOG_MODE
     LOG_MODE = True
 
-    r = extractor(file, test=True, label='Extracted')
-    print(f"Score: {r}")
+    keywords, profile = load_keywords(PATH['METRICS']), load_profile(PATH['METRICS'])
+    r = extractor(*read_document(file), keywords, profile, PATH['LABELS'], PATH['RESULTS'], test=True, label='Extracted')
+    print(f"Score: {score_pairs([r])[0] if r else r}")
 
 
 def test_title(title: str):
-    keyword_dataset =  pd.read_json(f'{PATH['METRICS']}/agg_title_metrics.json')
-    print(get_title(title, keyword_dataset))
+    keywords, profile = load_keywords(PATH['METRICS']), load_profile(PATH['METRICS'])
+    print(get_title(title, keywords, profile))
+
+
+def bench_titles(file: str, metric_path=PATH['METRICS'], repeat: int=5) -> float:
+    # Micro-benchmark of block scanning and title filtering, best of repeat runs over one parsed filing
+    keywords, profile = load_keywords(metric_path), load_profile(metric_path)
+    doc = make_document(*parse_file(file), profile)
+    best = float('inf')
+    for _ in range(repeat):
+        start, blocks = time.perf_counter(), 0
+        for _, line in scan_blocks(doc, profile):
+            get_title(line if doc.sec_html else R_SPACES.sub(' ', line), keywords, profile)
+            blocks += 1
+        best = min(best, time.perf_counter() - start)
+    # Only the blocks scan_blocks yields are counted, blank lines and prefiltered blocks are never scanned
+    rate = blocks / best
+    print(f"{doc.name}: {blocks} blocks, {rate:,.0f} blocks/s")
+    return rate
 
 if __name__ == "__main__":
 
@@ -0,0 +1,157 @@
+# Pluggable instrumentation, stages record counters and histograms through the active recorder
+# The default recorder does nothing, exporters keep the values for a local file or an RQ job's meta
+
+# First Party
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# *********************
+# CONST & VARIABLES
+# *********************
+TOP_N = 10      # Slowest or largest documents kept per histogram
+N_PROFILE_LINES = 40    # Functions listed in a saved profile's text summary
+
+
+# *********************
+# RECORDERS
+# *********************
+class Recorder:
+    # No-op default, so stages can record unconditionally
+    def count(self, name: str, value: int=1, key: str=None): pass
+    def observe(self, name: str, value: float, key: str=None): pass
+    def export(self): pass
+
+
+class MemoryRecorder(Recorder):
+    def __init__(self, top_n: int=TOP_N):
+        self.top_n = top_n
+        self.counters = defaultdict(Counter)    # Name -> key -> count
+        self.histograms = defaultdict(list)     # Name -> [(value, key)]
+
+    def count(self, name: str, value: int=1, key: str=None):
+        self.counters[name][key or "total"] += value
+
+    def observe(self, name: str, value: float, key: str=None):
+        self.histograms[name].append((value, key))
+
+    def snapshot(self) -> dict:
+        return {"counters":   {name: dict(counts) for name, counts in self.counters.items()},
+                "histograms": {name: summarize(values, self.top_n) for name, values in self.histograms.items()}}
+
+
+class FileExporter(MemoryRecorder):
+    def __init__(self, path, top_n: int=TOP_N):
+        super().__init__(top_n)
+        self.path = path
+
+    def export(self):
+        # Replaced whole, so a reader never sees a partial file
+        with open(f"{self.path}.part", 'w') as f: json.dump(self.snapshot(), f, indent=2)
+        os.replace(f"{self.path}.part", self.path)
+
+
+class JobMetaExporter(MemoryRecorder):
+    def __init__(self, job, top_n: int=TOP_N):
+        super().__init__(top_n)
+        self.job = job
+
+    def export(self):
+        self.job.meta['instrumentation'] = self.snapshot()
+        self.job.save_meta()
+
+
+# Context-local, so concurrent jobs in one process, e.g. on separate threads, never record into each other
+_RECORDER = ContextVar("recorder", default=Recorder())
+
+
+# *********************
+# HELPER FUNCTIONS
+# *********************
+def summarize(values: list, top_n: int=TOP_N) -> dict:
+    ordered = sorted(values, key=lambda value: value[0])
+    data = [value for value, _ in ordered]
+    def quantile(q): return data[min(int(q * len(data)), len(data) - 1)]
+    return {"count": len(data), "sum": sum(data), "mean": sum(data) / len(data), "min": data[0],
+            "p50": quantile(0.5), "p90": quantile(0.9), "p99": quantile(0.99), "max": data[-1],
+            "top": [[key, value] for value, key in reversed(ordered[-top_n:]) if key is not None]}
+
+
+def get_recorder() -> Recorder:
+    return _RECORDER.get()
+
+
+@contextmanager
+def recording(recorder: Recorder):
+    # Active until the block exits, the previous recorder of this context is restored even on errors
+    token = _RECORDER.set(recorder)
+    try: yield recorder
+    finally: _RECORDER.reset(token)
+
+
+def enabled() -> bool:
+    return type(_RECORDER.get()) is not Recorder
+
+
+# *********************
+# RECORD FUNCTIONS
+# *********************
+def count(name: str, value: int=1, key: str=None):
+    _RECORDER.get().count(name, value, key)
+
+
+def observe(name: str, value: float, key: str=None):
+    _RECORDER.get().observe(name, value, key)
+
+
+@contextmanager
+def timed(name: str, key: str=None):
+    start = time.perf_counter()
+    try: yield
+    finally: _RECORDER.get().observe(name, time.perf_counter() - start, key)
+
+
+def record_document(name: str, stats: dict):
+    # Per-document stats gathered in a worker process, numbers are histogram values keyed by document
+    # and strings are counted by value, e.g. a cache outcome
+    recorder = _RECORDER.get()
+    recorder.count("documents")
+    for stat, value in stats.items():
+        if stat == "failure": recorder.count("failures", key=value)
+        elif isinstance(value, str): recorder.count(stat, key=value)
+        elif isinstance(value, (int, float)): recorder.observe(stat, value, name)
+
+
+# *********************
+# PROFILING FUNCTIONS
+# *********************
+def profile_call(name: str, path, max_seconds: float, max_bytes: int, func, *args, **kwargs):
+    # Runs func under cProfile and tracemalloc, stats are only kept for slow or memory heavy calls
+    profiler, tracing = cProfile.Profile(), tracemalloc.is_tracing()
+    if not tracing: tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    profiler.enable()
+    try: return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        seconds, (_, peak) = time.perf_counter() - start, tracemalloc.get_traced_memory()
+        if not tracing: tracemalloc.stop()
+        if seconds >= max_seconds or peak >= max_bytes: save_profile(name, path, profiler, seconds, peak)
+
+
+def save_profile(name: str, path, profiler: cProfile.Profile, seconds: float, peak: int):
+    # A .prof file for pstats or snakeviz, and a text summary sorted by cumulative time
+    os.makedirs(path, exist_ok=True)
+    profiler.dump_stats(os.path.join(path, f"{name}.prof"))
+    summary = io.StringIO()
+    summary.write(f"Document:   {name}\nSeconds:    {seconds:.3f}\nPeak MB:    {peak / 1e6:.1f}\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(N_PROFILE_LINES)
+    with open(os.path.join(path, f"{name}.txt"), 'w') as f: f.write(summary.getvalue())
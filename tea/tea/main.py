@@ -1,9 +1,11 @@
 import argparse
 import os
+import sys
 
 from .extract import extraction_entry, test
 from .analysis import analysis_entry
-from .params import PATH, init_paths as params_init_paths
+from .instrument import FileExporter, Recorder, recording
+from .params import PATH, load_profile, init_paths as params_init_paths
 from .parse import parse_entry
 from .utils import time_execution
 
@@ -25,12 +27,15 @@ def get_args():
     parser.add_argument('--analyze', action='store_true', help="Rerun analysis layer")
     parser.add_argument('--log', action='store_true', help="Activate log print statements")
     parser.add_argument('--test', action='store_true', help="Activate test functions")
+    parser.add_argument('--profiling', action='store_true', help="Save profiles of slow or memory heavy documents")
+    parser.add_argument('--instrument', type=str, help="Path of a JSON file for stage and per-document stats")
     return parser.parse_args()
 
 def init_paths(args):
     PATH["LABELS"] = args.labels if args.labels is not None else PATH["LABELS"]
     PATH["RESULTS"] = args.output if args.output is not None else PATH["RESULTS"]
     PATH['TEXTS'] = args.texts if args.texts is not None else PATH['TEXTS']
+    os.makedirs(PATH["RESULTS"], exist_ok=True)
 
 def metrics_empty(path=PATH["METRICS"]):
     return not any(f in os.listdir(path) for 
@@ -51,8 +56,9 @@ def main():
         return -1
 
     init_paths(args)
-    
-    metrics_empty()
+    label_word = args.word or "Extracted"
+    ext = args.ext or ['.txt', '.htm', '.html']
+    mask = {os.path.splitext(f)[0] for _, _, files in os.walk(args.texts) for f in files}
 
     # The parse function automatically runs if needed. It stores the parsed files in 
     # the texts directory and reuses them for extraction. If no files are present
@@ -61,14 +67,20 @@ def main():
     # The extraction layer will always run, it requires the analysis layer to be run 
     # before. It stores results in directory unless user forces reanalysis.
 
-    parse_entry(args.texts, exclude=args.exclude, ext=args.ext)
-    if args.analyze or metrics_empty: analysis_entry(args.labels, args.word, ext=['.txt'])
-    # extraction_entry(args)
+    # Stats are only kept when a file is given, otherwise stage times are printed as before
+    with recording(FileExporter(args.instrument) if args.instrument else Recorder()) as recorder:
+        parse_entry(input_path=args.texts, output_path=args.texts, mask=mask, label=label_word, ext=ext)
+        if args.analyze or metrics_empty(): profile = analysis_entry(args.labels, PATH["METRICS"], label_word)
+        else: profile = load_profile(PATH["METRICS"])
+        extraction_entry(args.texts, PATH["METRICS"], args.labels, PATH["RESULTS"], label_word, mask=mask,
+                         log=args.log, test=args.test, profile=profile, profiling=args.profiling)
+    recorder.export()
 
     return 0
 
 @time_execution
-def extract_text(unique_id, label_word, mask, ext=[], analyze=False, log=False, test=False):
+def extract_text(unique_id, label_word, mask, ext=[], analyze=False, log=False, test=False, workers=None,
+                 persist=False, profiling=False, files=None, progress=None, archive=None, total=None):
 
     params_init_paths()
 
@@ -90,24 +102,26 @@ def extract_text(unique_id, label_word, mask, ext=[], analyze=False, log=False,
             f"Analyze:      {analyze}\n"
             f"Log:          {log}\n"
             f"Test:         {test}\n"
+            f"Persist:      {persist}\n"
+            f"Profiling:    {profiling}\n"
             f"Metrics:      {metrics_empty(metric_path)}\n"
 
         )
     
-    parse_entry(input_path=text_path, output_path=text_path, mask=mask, label=label_word, ext=ext)
-    if analyze or metrics_empty(metric_path): analysis_entry(label_path, metric_path, label_word)
-    extraction_entry(text_path, metric_path, label_path, output_path, label_word, mask=mask, exts=[".txt"], log=log, test=test)
+    # Parsed text is handed to the extractor in memory, intermediate .txt files are opt-in
+    if persist: parse_entry(input_path=text_path, output_path=text_path, mask=mask, label=label_word, ext=ext)
+    if analyze or metrics_empty(metric_path): profile = analysis_entry(label_path, metric_path, label_word)
+    else: profile = load_profile(metric_path)
+    return extraction_entry(text_path, metric_path, label_path, output_path, label_word, mask=mask,
+                            exts=[".txt"] if persist else ext, log=log, test=test, workers=workers,
+                            stream=not persist, profile=profile, profiling=profiling,
+                            files=None if persist else files, progress=progress, archive=archive, total=total)
 
-    return
     # init_paths(args)
     # parse_entry(args.texts, exclude=args.exclude, ext=args.ext)
     # if args.analyze: analysis_entry()
     # extraction_entry(args)
 
 if __name__ == '__main__':
-    text_path = "/Users/sharjeelmustafa/Desktop/RA24_Testing/texts"
-    label_path = "/Users/sharjeelmustafa/Desktop/RA24_Testing/labels"
-    label_word = "Extracted"
-    ext = [".txt", ".htm", ".html"]
-    extract_text(text_path, label_path, label_word, ext=ext, log=False, test=True)
-    
\ No newline at end of file
+    # Run from the tea folder as python -m tea.main
+    sys.exit(main())
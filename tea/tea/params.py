@@ -1,4 +1,6 @@
+import json
 import os
+from collections.abc import Mapping
 from pathlib import Path
 
 # Uses the current file path to dynamically get the root path
@@ -11,6 +13,7 @@ PATH = {
     "RESULTS":  _ROOT_PATH / 'data' / 'results',
     "LABELS":   _ROOT_PATH / 'data' / 'labels',
     "METRICS":  _ROOT_PATH / 'data' / 'metrics',
+    "CACHE":    _ROOT_PATH / 'data' / 'cache',
 }
 
 # Change the default parameters for each dataset
@@ -22,6 +25,17 @@ DEFAULT = {
     "MAX_SECT_SIZE": 673,       # Max size of a section (100 char units) based on pre-analysis
     "MAX_LINE_SIZE": 14,        # Max size of a line (word units) based on pre-analysis
     "SUCCESS_THRESHOLD": 70,   # Threshold percent for successful extraction
+    "N_WORKERS": None,          # Extraction worker processes, None uses every available core
+    "SUBMIT_WINDOW": 4,         # Documents queued per worker, bounds the pending results held in memory
+    "POS_TAGGER": "spacy",      # Keyword POS tagger, opt into "lexicon" to skip spaCy for offline deployments
+    "NLP_BATCH_SIZE": 256,      # Titles tagged per nlp.pipe batch
+    "NLP_N_PROCESS": 1,         # Processes used by nlp.pipe
+    "METRICS_CACHE_BYTES": 64_000_000,  # Size limit of the analysis cache shared across jobs
+    "RESULT_CACHE_BYTES": 512_000_000,  # Size limit of the extracted section cache, 0 disables reuse
+    "PARSE_CACHE_BYTES": 1_000_000_000, # Size limit of the compressed parsed HTML cache, 0 disables reuse
+    "PROFILING_SECONDS": 10,    # Profiling mode keeps stats for documents slower than this
+    "PROFILING_PEAK_MB": 256,   # or whose traced memory peak exceeds this
+    "ZIP_LEVEL": 6,             # Result archive deflate level, 0 stores entries uncompressed
     # Title Word Parameters (differs per dataset)
     "REPEATABLE_KEYWORDS": ["advisory", "agreement", "agreements", "management"],
     "SPECIAL_PHRASES": ["investment advisory", "investment sub-advisory"]
@@ -32,6 +46,34 @@ DELIM = {
     "WORD": " "
 }
 
+class Profile(Mapping):
+    # Read-only per-job parameters, DEFAULT with the job's analysis constants applied.
+    # Passed explicitly so concurrent jobs in one process never share constants
+    def __init__(self, values: dict):
+        self._values = dict(values)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Profile({self._values})"
+
+
+def make_profile(**constants) -> Profile:
+    return Profile({**DEFAULT, **constants})
+
+def load_profile(metric_path) -> Profile:
+    # Metrics from before constants.json was written fall back to the defaults
+    constants_path = os.path.join(metric_path, 'constants.json')
+    if not os.path.exists(constants_path): return make_profile()
+    with open(constants_path) as f: return make_profile(**json.load(f))
+
 def init_paths():
     for _, value in PATH.items(): os.makedirs(value, exist_ok=True)
 
@@ -2,14 +2,26 @@
 # Designed for extension to other file types
 
 # First Party
+import gzip
+import io
 import os
 import re
+import shutil
+import time
 
 # Third Party
 from selectolax.parser import HTMLParser
 
+from .archive import Member, member_size, open_member
+from .cache import evict, hash_file, lookup, store
+from .instrument import count, observe
+from .params import DEFAULT
 from .utils import time_execution
 
+# zstd is optional, parsed text is cached with gzip when it is not installed
+try: import zstandard
+except ImportError: zstandard = None
+
 # selenium parsing is too slow, and hand parsing is too hard
 # Need to use more built-in features from selectolax
 
@@ -17,6 +29,13 @@ from .utils import time_execution
 # CONST & VARIABLES
 # *********************
 N_TOP_HTML_CHARS =  2325
+STREAM_PARSE_BYTES = 64_000_000     # Filings above this size are parsed segment by segment
+SEGMENT_CHARS = 4_000_000           # Soft cap on a segment, split after a closing block tag
+BLOCK_ENDS = ("</div>", "</p>", "</tr>", "</table>")
+BODY = "<body>"
+# Bump when a change alters parsed output, older cache entries then stop matching
+PARSER_VERSION = 2
+PARSE_CACHE, ZSTD_FILE, GZIP_FILE = "parsed", "text.zst", "text.gz"
 
 # Generic Regex
 rm_graphic = r"<DOCUMENT>\n?<TYPE>GRAPHIC(.*\n)*?<\/DOCUMENT>"
@@ -34,6 +53,24 @@ rm_end = r"</(div|tr|table)>"
 rm_td_start = r"<td[\w\n =\"-:;%>]*>"
 rm_td_end = r"</td>"
 
+# Single-pass cleanup engine: each phase above is one combined, precompiled alternation.
+# Alternatives share a literal first character so the regex engine can still skip ahead quickly.
+# A sup tag may span <br> tags, as the sequential passes had already turned them into BREAK
+R_REMOVE = re.compile(r"<(?:(?P<sup>sup(?:[\w\n =\"-:;%>]|<br>)*</sup>)|(?P<br>br>))", re.IGNORECASE)
+R_CONVERT = re.compile(r"<(?:(?P<start>(?:div|tr|table)[\w\n =\"-:;%>]*>)|(?P<end>/(?:div|tr|table)>)|"
+                       r"(?P<td>td[\w\n =\"-:;%>]*>|/td>))", re.IGNORECASE)
+# Output starts with SEC_HTML, so every blank line follows a newline. Removing blank lines
+# also collapses runs of newlines, so rm_extranl needs no pass of its own
+R_CLEAN = re.compile(r"\n(?P<empty>\s+$)| (?P<spaces> +)|B(?P<BREAK>(?i:REAK))|b(?P<break>(?i:REAK))",
+                     re.MULTILINE)
+R_EXTRA = re.compile(r"[*|•|\s]*")
+REMOVE = {"sup": "", "br": "BREAK"}
+CONVERT = {"start": "<p>", "end": "</p>", "td": ""}
+CLEAN = {"empty": "\n", "spaces": " ", "BREAK": "\n", "break": "\n"}
+# Same paragraph breaks, \xa0 became a newline that was then replaced by a space
+SPACING = str.maketrans({"\t": " ", "\xa0": " ", "\u2003": "  ", "\n": " "})
+GRAPHIC, GRAPHIC_TYPE, GRAPHIC_END = "<DOCUMENT>", "<TYPE>GRAPHIC", "</DOCUMENT>"
+
 rm_font = r"^<font[\w\n =\"-:;%>]*>"
 rm_font_end = r"</font>"
 
@@ -42,47 +79,52 @@ rm_font_end = r"</font>"
 # PARSE FUNCTIONS
 # *********************
 def parse_html(file_path) -> str:
-    file_path = rename_file_extension(file_path, '.txt')
     # print(f"Processing: {file_path.split('/')[-1]}")
-    
-    output = "SEC_HTML\n"
-    text = open(file_path, 'r').read()
+    with open(file_path, 'r') as f: text = f.read()
+    return clean_output("SEC_HTML\n" + parse_paragraphs(text))
+
+
+def iter_html(f):
+    # Bounded-memory parse of an open text stream, yields text per segment as it is produced. Each piece
+    # stops at its last text line, trailing blank lines are carried so postprocessing matches a whole parse
+    carry = "SEC_HTML\n"
+    for i, segment in enumerate(iter_segments(f)):
+        # Later segments start inside the body, where a stray end tag opens an empty paragraph as in a whole parse
+        output = carry + parse_paragraphs(BODY + segment if i else segment)
+        cut = output.find("\n", len(output.rstrip()))
+        if cut == -1: 
+            carry = output
+            continue
+        yield clean_output(output[:cut])
+        carry = output[cut:]
+    yield clean_output(carry)
+
+
+def parse_paragraphs(text: str) -> str:
+    output = []
 
     # Preprocess: Tag Removal
-    text = re.sub(rm_graphic, "", text)
-    text = re.sub(rm_br, "BREAK", text, flags=re.IGNORECASE)
-    text = re.sub(rm_sup, "", text, flags=re.IGNORECASE)
+    text = remove_graphics(text)
+    text = R_REMOVE.sub(lambda m: REMOVE[m.lastgroup], text)
 
     # Preprocess: Tag Conversion    
-    text = re.sub(rm_start, "<p>", text, flags=re.IGNORECASE)
-    text = re.sub(rm_end, "</p>", text, flags=re.IGNORECASE)
-    text = re.sub(rm_td_start, "", text, flags=re.IGNORECASE)
-    text = re.sub(rm_td_end, "", text, flags=re.IGNORECASE)
+    text = R_CONVERT.sub(lambda m: CONVERT[m.lastgroup], text)
 
     # HTML Parsing
     html = HTMLParser(text)
     for element in html.css("p"):
-        element_text = element.text(deep=True)
-
-        # Remove same paragraph breaks
-        element_text = re.sub("\t", " ", element_text)
-        element_text = re.sub("\xa0", "\n", element_text)
-        element_text = re.sub("\u2003", "  ", element_text)
-        element_text = re.sub("\n", " ", element_text)
-
-        # Remove Bullets
-        element_text = re.sub(rm_extra, "", element_text)
+        # Remove same paragraph breaks and bullets
+        element_text = element.text(deep=True).translate(SPACING)
+        if R_EXTRA.fullmatch(element_text): element_text = ""
         element_text = element_text.strip()
-        if element_text:    output += element_text + "\n"
-        else:               output += "\n"
+        if element_text:    output.append(element_text + "\n")
+        else:               output.append("\n")
+    return "".join(output)
 
-    # Postprocess: Text Cleaning
-    output = re.sub(rm_extranl, "\n\n", output)
-    output = re.sub(rm_empty, "", output, flags=re.MULTILINE)
-    output = re.sub(rm_spaces, " ", output)
-    output = re.sub("BREAK", "\n", output, flags=re.IGNORECASE)
 
-    return output
+def clean_output(output: str) -> str:
+    # Postprocess: Text Cleaning
+    return R_CLEAN.sub(lambda m: CLEAN[m.lastgroup], output)
 
 
 def parse_text(file_path)-> str:
@@ -90,27 +132,171 @@ def parse_text(file_path)-> str:
     return text
 
 
+def parse_file(file) -> tuple[str, str]:
+    # Returns a (name, text) record for the extraction layer
+    if not is_html(file):   text = parse_text(file)
+    elif is_large(file):
+        with open(file, 'r') as f: text = "".join(iter_html(f))
+    else:                   text = parse_html(file)
+    file_name = os.path.splitext(os.path.basename(file))[0]
+    return file_name, text
+
+
+def parse_stream(member: str, raw, size: int, errors: str="replace") -> tuple[str, str]:
+    # Counterpart of parse_file for archive members. The bytes are read through the same text
+    # layer as open(), so newlines are translated exactly as for files on disk
+    with io.TextIOWrapper(raw, encoding='utf-8', errors=errors) as f:
+        html = f.read(N_TOP_HTML_CHARS).lower().find('<html>') != -1
+        f.seek(0)
+        if not html:                    text = f.read()
+        elif size > STREAM_PARSE_BYTES: text = "".join(iter_html(f))
+        else:                           text = clean_output("SEC_HTML\n" + parse_paragraphs(f.read()))
+    return source_name(member), text
+
+
+def parse_content(member: str, data: bytes, errors: str="replace") -> tuple[str, str]:
+    # Members of a tar.gz are read in order by the parent and arrive in memory
+    return parse_stream(member, io.BytesIO(data), len(data), errors)
+
+
+def parse_member(member: Member, errors: str="replace") -> tuple[str, str]:
+    # Zip members are opened in the worker, so large filings stream through iter_html
+    return parse_stream(member.name, open_member(member), member_size(member), errors)
+
+
+def parse_source(source) -> tuple[str, str]:
+    # Sources are file paths, zip Members, or (member, data) records read from a tar.gz
+    if isinstance(source, Member): return parse_member(source)
+    if isinstance(source, tuple):  return parse_content(*source)
+    return parse_file(source)
+
+
 def parse_files(files, output_folder):
+    cache = DEFAULT["PARSE_CACHE_BYTES"]
     for file in files:
-        text = "None"
-        if is_html(file):   text = parse_html(file)
-        else:               text = parse_text(file)
-
-        # Write to output file
-        full_name = os.path.basename(file)
-        file_name = os.path.splitext(full_name)[0]
+        start, size = time.perf_counter(), os.path.getsize(file)
+        html = is_html(file)
+        file_name = os.path.splitext(os.path.basename(file))[0]
         output_file = os.path.join(output_folder, f"{file_name}.txt")
-        with open(output_file, 'w') as f: f.write(text)
+
+        # Parsed HTML depends only on the raw bytes, plain text is read as is and never cached
+        key = hash_file(file, PARSER_VERSION) if html and cache else None
+        hit = key is not None and load_parsed(key, output_file)
+        if key: count("parse_cache", key="hit" if hit else "miss")
+
+        # Large filings are written as they are parsed, through a temporary file
+        # as the output may replace the input
+        if not hit and html and is_large(file):
+            with open(file, 'r') as src, open(output_file + ".part", 'w') as f: f.writelines(iter_html(src))
+            os.replace(output_file + ".part", output_file)
+        elif not hit:
+            text = parse_html(file) if html else parse_text(file)
+            with open(output_file, 'w') as f: f.write(text)
+        if key and not hit: store(PARSE_CACHE, key, dict([compress_file(output_file)]))
+        observe("parse_seconds", time.perf_counter() - start, file_name)
+        observe("parse_bytes_read", size, file_name)
+        observe("parse_bytes_written", os.path.getsize(output_file), file_name)
+
+        # Parsed HTML replaces the original upload
+        if html and os.path.abspath(file) != os.path.abspath(output_file): os.remove(file)
+    if cache: count("parse_cache_evictions", evict(PARSE_CACHE, cache))
 
 
 # *********************
 # HELPER FUNCTIONS
 # *********************
-def rename_file_extension(file_path, ext):
-    ext = ext if ext.startswith('.') else '.' + ext
-    new_path = os.path.splitext(file_path)[0] + ext
-    os.rename(file_path, new_path)
-    return new_path
+def remove_graphics(text: str) -> str:
+    # Same matches as rm_graphic, found with str.find instead of a backtracking line loop
+    parts, start = [], 0
+    i = text.find(GRAPHIC)
+    while i != -1:
+        j = i + len(GRAPHIC)
+        if text.startswith("\n", j): j += 1
+        if text.startswith(GRAPHIC_TYPE, j):
+            j += len(GRAPHIC_TYPE)
+            # The lazy line loop stops at the first end tag right after the type or at a line start
+            end = j if text.startswith(GRAPHIC_END, j) else text.find("\n" + GRAPHIC_END, j) + 1
+            if end > 0:
+                parts.append(text[start:i])
+                start = end + len(GRAPHIC_END)
+                i = text.find(GRAPHIC, start)
+                continue
+        i = text.find(GRAPHIC, i + 1)
+    parts.append(text[start:])
+    return "".join(parts)
+
+
+def iter_segments(f):
+    # Reads one <DOCUMENT> at a time from an open text stream, GRAPHIC documents are dropped while being read
+    segment, size, skip, pending = [], 0, False, None
+    for line in f:
+        if skip:
+            if not line.startswith(GRAPHIC_END): continue
+            line, skip = line[len(GRAPHIC_END):], False
+        elif pending is not None:
+            if line.startswith(GRAPHIC_TYPE) and not line.startswith(GRAPHIC_END, len(GRAPHIC_TYPE)):
+                pending, skip = None, True
+                continue
+            segment.append(pending)
+            pending = None
+        elif line == GRAPHIC + "\n":
+            pending = line
+            continue
+
+        segment.append(line)
+        size += len(line)
+        end = line.rstrip()
+        if end.endswith(GRAPHIC_END) or size >= SEGMENT_CHARS and end.lower().endswith(BLOCK_ENDS):
+            yield "".join(segment)
+            segment, size = [], 0
+
+    if pending is not None: segment.append(pending)
+    if segment: yield "".join(segment)
+
+
+def source_name(source) -> str:
+    if isinstance(source, Member):  path = source.name
+    elif isinstance(source, tuple): path = source[0]
+    else:                           path = source
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def source_size(source) -> int:
+    if isinstance(source, Member):  return member_size(source)
+    if isinstance(source, tuple):   return len(source[1])
+    return os.path.getsize(source)
+
+
+def compress_file(path) -> tuple[str, bytes]:
+    # Returns the cache file name and contents, compressed from disk in chunks
+    buffer = io.BytesIO()
+    with open(path, 'rb') as src:
+        if zstandard: zstandard.ZstdCompressor().copy_stream(src, buffer)
+        else:
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=1, mtime=0) as dst: shutil.copyfileobj(src, dst, 1 << 20)
+    return ZSTD_FILE if zstandard else GZIP_FILE, buffer.getvalue()
+
+
+def load_parsed(key: str, output_file) -> bool:
+    entry = lookup(PARSE_CACHE, key)
+    if entry is None: return False
+    # Evicted by another job between the lookup and the read, or stored with zstd
+    # where it is not installed, counts as a miss
+    try:
+        with open(output_file + ".part", 'wb') as dst:
+            if zstandard and (entry / ZSTD_FILE).exists():
+                with open(entry / ZSTD_FILE, 'rb') as src: zstandard.ZstdDecompressor().copy_stream(src, dst)
+            else:
+                with gzip.open(entry / GZIP_FILE, 'rb') as src: shutil.copyfileobj(src, dst, 1 << 20)
+    except FileNotFoundError:
+        os.remove(output_file + ".part")
+        return False
+    os.replace(output_file + ".part", output_file)
+    return True
+
+
+def is_large(path):
+    return os.path.getsize(path) > STREAM_PARSE_BYTES
 
 
 def is_html(path):
@@ -1,11 +1,17 @@
 # First-party Imports
 import re
 import os
+from hashlib import blake2b
+
+# Third-party Imports
+import numpy as np
 
 # Local Imports
 from .params import PATH
 
 R_SENTENCE = r"^(\w+\s\w+\s\w+\s?)((\w+|-)\s?)*"
+# Collapses whitespace runs in one pass, newlines and tabs included
+R_SPACES = re.compile(r"\s+")
 TESTING = False
 
 # *********************
@@ -25,23 +31,24 @@ def get_text(file1: str, file2: str):
 # *********************
 def tokenize(text: str, unit: str=None):
     if unit == 'line':
-        text = re.sub(r'[\n\t\r]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
+        text = R_SPACES.sub(' ', text)
         chunks, n = [], 100
         for i in range(0, len(text), n):
             chunk = text[i:i+n]
             chunks.append(chunk)
         return chunks
     elif unit == 'sentence':
-        text = re.sub(r'[\n\t\r]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
+        # Same as collapsing whitespace runs, the ends it also drops are stripped from sentences anyway
+        text = ' '.join(text.split())
         sentences = [sentence.strip() for sentence in text.split('.')]  # Strip each sentence
         return sentences
     return text.lower().split(' ')
 
 def overlap_similarity(label: str, pred: str):
-    
     ltext, ptext = get_text(label, pred)
+    return overlap_score(ltext, ptext)
+
+def overlap_score(ltext: str, ptext: str):
     lwords = tokenize(ltext, "sentence")
     pwords = tokenize(ptext, "sentence")
 
@@ -56,6 +63,30 @@ def overlap_similarity(label: str, pred: str):
     intersection = len(lwords.intersection(pwords))
     return intersection / len(lwords)
 
+# *********************
+# BATCH SIMILARITY METHOD
+# *********************
+def hash_sentences(text: str) -> np.ndarray:
+    # Unique 64-bit sentence hashes, blake2b is stable across worker processes unlike hash()
+    digests = {blake2b(s.encode(), digest_size=8).digest() for s in tokenize(text, "sentence")}
+    return np.frombuffer(b"".join(digests), dtype=np.uint64)
+
+def batch_overlap(pairs: list) -> np.ndarray:
+    # Overlap coefficient of every (label, pred) pair of sentence hashes in one pass
+    n = len(pairs)
+    if not n: return np.empty(0)
+    lsizes = np.array([len(lhashes) for lhashes, _ in pairs])
+    psizes = np.array([len(phashes) for _, phashes in pairs])
+    docs = np.concatenate([np.repeat(np.arange(n), lsizes), np.repeat(np.arange(n), psizes)])
+    hashes = np.concatenate([lhashes for lhashes, _ in pairs] + [phashes for _, phashes in pairs])
+
+    # Hashes are unique per side, so a (doc, hash) pair seen twice is in both
+    order = np.lexsort((hashes, docs))
+    docs, hashes = docs[order], hashes[order]
+    both = (docs[1:] == docs[:-1]) & (hashes[1:] == hashes[:-1])
+    intersection = np.bincount(docs[1:][both], minlength=n)
+    return intersection / lsizes
+
 # *********************
 # ADDITIONAL METHODS
 # *********************
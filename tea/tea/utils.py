@@ -1,9 +1,12 @@
 import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import wraps
 from typing import List
-import matplotlib.pyplot as plt
 
 import pandas as pd
 
+from . import instrument
+
 # *********************
 # EXTRACT HELPER FUNCTIONS
 # *********************
@@ -44,6 +47,8 @@ def plot(results_series: pd.Series):
     if results_series is None: return None
     if results_series.empty: return None
 
+    # Imported here as pyplot is slow to load and only needed for plots
+    import matplotlib.pyplot as plt
     plt.plot(results_series)
     plt.xlabel('File Index')
     plt.ylabel('Similarity (%)')
@@ -56,16 +61,34 @@ def plot(results_series: pd.Series):
 # HELPER FUNCTIONS
 # *********************
 def time_execution(func):
+    # wraps keeps the stage's name, so decorated entry points can be pickled to a benchmark process
+    @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
         result = func(*args, **kwargs)
         execution_time = time.time() - start_time
+        # Printed only when no recorder collects the stage times
+        instrument.observe("stage_seconds", execution_time, func.__name__)
+        if instrument.enabled(): return result
         m, s = divmod(execution_time, 60)
         ms = (execution_time - int(execution_time)) * 1000
         print(f"\033[91;1mEXECUTION TIME: {int(m):02}:{int(s):02}.{int(ms):03}\033[0m")
         return result
     return wrapper
 
+def pipeline(executor, func, items, window: int):
+    # Yields (item, result) as tasks complete, keeping at most window tasks in flight.
+    # Unlike executor.map the items are submitted lazily and results never wait on a slower predecessor
+    items, pending = iter(items), {}
+    for item in items:
+        pending[executor.submit(func, item)] = item
+        if len(pending) < window: continue
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done: yield pending.pop(future), future.result()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done: yield pending.pop(future), future.result()
+
 # *********************
 # MAIN FUNCTION
 # *********************
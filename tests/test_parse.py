@@ -0,0 +1,35 @@
+# Golden-file checks for the SEC HTML parser, the expected output was produced by the original parse_html.
+# A change that alters the expected output must also bump PARSER_VERSION, so cached parses are not reused
+import io
+import os
+import shutil
+
+import pytest
+
+from tea.tea import parse
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+RAW, EXPECTED = os.path.join(FIXTURES, 'sec_filing.htm'), os.path.join(FIXTURES, 'sec_filing.txt')
+
+
+@pytest.fixture
+def expected() -> str:
+    with open(EXPECTED) as f: return f.read()
+
+
+def test_parse_html(tmp_path, expected):
+    raw = shutil.copy(RAW, tmp_path)
+    assert parse.parse_html(raw) == expected
+
+
+@pytest.mark.parametrize("segment_chars", [1, 200, parse.SEGMENT_CHARS])
+def test_iter_html(monkeypatch, expected, segment_chars):
+    # Small segments split the filing after every closing block tag, as a large filing would be
+    monkeypatch.setattr(parse, "SEGMENT_CHARS", segment_chars)
+    with open(RAW) as f: assert "".join(parse.iter_html(f)) == expected
+
+
+def test_parse_content(expected):
+    with open(RAW, 'rb') as f: data = f.read()
+    assert parse.parse_content("sec_filing.htm", data) == ("sec_filing", expected)
+    assert parse.parse_stream("sec_filing.htm", io.BytesIO(data), parse.STREAM_PARSE_BYTES + 1) == ("sec_filing", expected)